@@ -6,10 +6,16 @@ from functools import lru_cache
 import numpy as np
 from collections import OrderedDict
 import threading
+import xxhash
 
 logger = logging.getLogger(__name__)
 
 
+def content_hash(text: str) -> int:
+    """64-bit xxhash of a text, used to key chunks and documents in caches and fusion"""
+    return xxhash.xxh3_64_intdigest(text.encode('utf-8'))
+
+
 class EmbeddingCache:
     """LRU cache for query embeddings to speed up repeated queries"""
     
@@ -122,9 +128,16 @@ class QueryCache:
         
         logger.info(f"Query cache initialized with max_size={max_size}, ttl={ttl_seconds}s")
     
-    def _compute_key(self, query: str, n_results: int, use_hybrid: bool) -> str:
-        """Compute cache key for query parameters"""
-        content = f"{query}:{n_results}:{use_hybrid}"
+    def _compute_key(
+        self,
+        query: str,
+        n_results: int,
+        use_hybrid: bool,
+        score_cutoff: Optional[float] = None,
+        version: int = 0
+    ) -> str:
+        """Compute cache key for query parameters and collection version"""
+        content = f"{query}:{n_results}:{use_hybrid}:{score_cutoff}:{version}"
         return hashlib.sha256(content.encode('utf-8')).hexdigest()[:16]
     
     def _is_expired(self, key: str) -> bool:
@@ -136,14 +149,21 @@ class QueryCache:
         age = time.time() - self.timestamps[key]
         return age > self.ttl_seconds
     
-    def get(self, query: str, n_results: int, use_hybrid: bool) -> Optional[Any]:
+    def get(
+        self,
+        query: str,
+        n_results: int,
+        use_hybrid: bool,
+        score_cutoff: Optional[float] = None,
+        version: int = 0
+    ) -> Optional[Any]:
         """
         Get cached query results
         
         Returns:
             Cached (documents, metadata) tuple or None
         """
-        key = self._compute_key(query, n_results, use_hybrid)
+        key = self._compute_key(query, n_results, use_hybrid, score_cutoff, version)
         
         with self.lock:
             if key in self.cache and not self._is_expired(key):
@@ -162,7 +182,15 @@ class QueryCache:
                 self.misses += 1
                 return None
     
-    def put(self, query: str, n_results: int, use_hybrid: bool, result: Any):
+    def put(
+        self,
+        query: str,
+        n_results: int,
+        use_hybrid: bool,
+        result: Any,
+        score_cutoff: Optional[float] = None,
+        version: int = 0
+    ):
         """
         Store query results in cache
         
@@ -171,9 +199,11 @@ class QueryCache:
             n_results: Number of results
             use_hybrid: Hybrid search flag
             result: (documents, metadata) tuple to cache
+            score_cutoff: Relevance cutoff used for the search
+            version: Collection version the results were computed against
         """
         import time
-        key = self._compute_key(query, n_results, use_hybrid)
+        key = self._compute_key(query, n_results, use_hybrid, score_cutoff, version)
         
         with self.lock:
             # Remove oldest if at capacity
@@ -209,4 +239,371 @@ class QueryCache:
             self.timestamps.clear()
             self.hits = 0
             self.misses = 0
-            logger.info("Query cache cleared")
\ No newline at end of file
+            logger.info("Query cache cleared")
+
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries also expire after ttl_seconds"""
+    
+    name = "TTL"
+    
+    def __init__(self, max_size: int, ttl_seconds: int):
+        """
+        Initialize the cache
+        
+        Args:
+            max_size: Maximum number of cached entries
+            ttl_seconds: Time-to-live for cache entries
+        """
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.cache = OrderedDict()
+        self.timestamps = {}
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        
+        logger.info(f"{self.name} cache initialized with max_size={max_size}, ttl={ttl_seconds}s")
+    
+    def _get(self, key: Any) -> Optional[Any]:
+        """Return the entry for key (marking it most recently used), or None if missing / expired"""
+        import time
+        with self.lock:
+            if key in self.cache:
+                if time.time() - self.timestamps[key] <= self.ttl_seconds:
+                    self.cache.move_to_end(key)
+                    self.hits += 1
+                    return self.cache[key]
+                
+                # Expired entry, remove it
+                del self.cache[key]
+                del self.timestamps[key]
+            
+            self.misses += 1
+            return None
+    
+    def _put(self, key: Any, value: Any):
+        """Store an entry, evicting the least recently used one when full"""
+        import time
+        with self.lock:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+            elif len(self.cache) >= self.max_size:
+                oldest_key = next(iter(self.cache))
+                del self.cache[oldest_key]
+                del self.timestamps[oldest_key]
+            
+            self.cache[key] = value
+            self.timestamps[key] = time.time()
+    
+    def get_stats(self) -> dict:
+        """Get cache statistics"""
+        total_requests = self.hits + self.misses
+        hit_rate = (self.hits / total_requests * 100) if total_requests > 0 else 0
+        
+        return {
+            'size': len(self.cache),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': f"{hit_rate:.1f}%",
+            'total_requests': total_requests,
+            'ttl_seconds': self.ttl_seconds
+        }
+    
+    def clear(self):
+        """Clear all cached entries"""
+        with self.lock:
+            self.cache.clear()
+            self.timestamps.clear()
+            self.hits = 0
+            self.misses = 0
+            logger.info(f"{self.name} cache cleared")
+
+
+class ResponseCache(TTLCache):
+    """Cache for generated LLM responses keyed by (model, system prompt, query)"""
+    
+    name = "Response"
+    
+    def __init__(self, max_size: int = 256, ttl_seconds: int = 3600):
+        super().__init__(max_size, ttl_seconds)
+    
+    def _compute_key(self, model: str, system_message: str, query: str) -> str:
+        """Compute cache key for a prompt (the system message already embeds the retrieved context)"""
+        content = f"{system_message}\x1f{query}\x1f{model}"
+        return hashlib.blake2b(content.encode('utf-8'), digest_size=16).hexdigest()
+    
+    def get(self, model: str, system_message: str, query: str) -> Optional[str]:
+        """
+        Get cached response
+        
+        Returns:
+            Cached response text or None if not found / expired
+        """
+        response = self._get(self._compute_key(model, system_message, query))
+        if response is not None:
+            logger.debug(f"Response cache HIT: {query[:50]}...")
+        return response
+    
+    def put(self, model: str, system_message: str, query: str, response: str):
+        """Store a generated response in cache"""
+        self._put(self._compute_key(model, system_message, query), response)
+        logger.debug(f"Response cached: {query[:50]}...")
+
+
+class AnswerCache(TTLCache):
+    """Exact-match cache for full answers keyed by (normalized query, tag)"""
+    
+    name = "Answer"
+    
+    def __init__(self, max_size: int = 1024, ttl_seconds: int = 900):
+        super().__init__(max_size, ttl_seconds)
+    
+    def get(self, query: str, tag: Any = None) -> Optional[Any]:
+        """
+        Get the cached answer for this exact query
+        
+        Args:
+            query: Normalized query text
+            tag: Extra key that must match exactly (e.g. language flag, index version)
+        
+        Returns:
+            Cached entry or None if not found / expired
+        """
+        entry = self._get((query, tag))
+        if entry is not None:
+            logger.debug(f"Answer cache HIT: {query[:50]}...")
+        return entry
+    
+    def put(self, query: str, entry: Any, tag: Any = None):
+        """Store an answer in cache"""
+        self._put((query, tag), entry)
+
+
+class SemanticCache:
+    """Cache for full answers looked up by query embedding similarity (catches paraphrased questions)"""
+    
+    def __init__(self, max_size: int = 512, similarity_threshold: float = 0.93, ttl_seconds: int = 3600):
+        """
+        Initialize semantic answer cache (fixed-size ring buffer)
+        
+        Args:
+            max_size: Maximum number of cached answers
+            similarity_threshold: Minimum cosine similarity for a hit
+            ttl_seconds: Time-to-live for cache entries (1 hour default)
+        """
+        self.max_size = max_size
+        self.similarity_threshold = similarity_threshold
+        self.ttl_seconds = ttl_seconds
+        self.embeddings = None  # (max_size, dim) float32, allocated on first put
+        self.entries = [None] * max_size
+        self.tags = [None] * max_size
+        self.timestamps = np.zeros(max_size, dtype=np.float64)
+        self.size = 0
+        self.next_slot = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        
+        logger.info(f"Semantic cache initialized with max_size={max_size}, threshold={similarity_threshold}")
+    
+    @staticmethod
+    def _normalize(embedding: np.ndarray) -> np.ndarray:
+        """L2-normalize an embedding as float32"""
+        embedding = np.asarray(embedding, dtype=np.float32).ravel()
+        norm = np.linalg.norm(embedding)
+        return embedding / norm if norm > 0 else embedding
+    
+    def get(self, embedding: np.ndarray, tag: Any = None) -> Optional[Any]:
+        """
+        Get the cached entry whose query embedding is most similar to this one
+        
+        Args:
+            embedding: Query embedding
+            tag: Extra key that must match exactly (e.g. response language flags)
+        
+        Returns:
+            Cached entry or None if no entry reaches the similarity threshold
+        """
+        import time
+        query = self._normalize(embedding)
+        
+        with self.lock:
+            if self.size == 0 or self.embeddings.shape[1] != query.shape[0]:
+                self.misses += 1
+                return None
+            
+            similarities = self.embeddings[:self.size] @ query
+            
+            # Ignore expired entries and entries with a different tag
+            expired = self.timestamps[:self.size] < time.time() - self.ttl_seconds
+            similarities[expired] = -np.inf
+            for i in range(self.size):
+                if self.tags[i] != tag:
+                    similarities[i] = -np.inf
+            
+            best = int(similarities.argmax())
+            if similarities[best] >= self.similarity_threshold:
+                self.hits += 1
+                logger.debug(f"Semantic cache HIT (similarity={similarities[best]:.3f})")
+                return self.entries[best]
+            
+            self.misses += 1
+            return None
+    
+    def put(self, embedding: np.ndarray, entry: Any, tag: Any = None):
+        """Store an entry, overwriting the oldest slot when full"""
+        import time
+        query = self._normalize(embedding)
+        
+        with self.lock:
+            if self.embeddings is None or self.embeddings.shape[1] != query.shape[0]:
+                # First entry (or embedding model changed) - (re)allocate the buffer
+                self.embeddings = np.zeros((self.max_size, query.shape[0]), dtype=np.float32)
+                self.size = 0
+                self.next_slot = 0
+            
+            slot = self.next_slot
+            self.embeddings[slot] = query
+            self.entries[slot] = entry
+            self.tags[slot] = tag
+            self.timestamps[slot] = time.time()
+            
+            self.next_slot = (slot + 1) % self.max_size
+            self.size = min(self.size + 1, self.max_size)
+    
+    def get_stats(self) -> dict:
+        """Get cache statistics"""
+        total_requests = self.hits + self.misses
+        hit_rate = (self.hits / total_requests * 100) if total_requests > 0 else 0
+        
+        return {
+            'size': self.size,
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': f"{hit_rate:.1f}%",
+            'total_requests': total_requests,
+            'similarity_threshold': self.similarity_threshold
+        }
+    
+    def clear(self):
+        """Clear all cached entries"""
+        with self.lock:
+            self.embeddings = None
+            self.entries = [None] * self.max_size
+            self.tags = [None] * self.max_size
+            self.timestamps[:] = 0
+            self.size = 0
+            self.next_slot = 0
+            self.hits = 0
+            self.misses = 0
+            logger.info("Semantic cache cleared")
+
+
+class ScoreCache:
+    """LRU cache of cross-encoder scores keyed by (exact query text, document hash)
+    
+    The query is not normalized: the reranker tokenizer is case-sensitive, so "Paris" and
+    "paris" can score differently.
+    """
+    
+    def __init__(self, max_size: int = 50_000):
+        """
+        Initialize reranker score cache
+        
+        Args:
+            max_size: Maximum number of cached (query, document) scores
+        """
+        self.max_size = max_size
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        
+        logger.info(f"Score cache initialized with max_size={max_size}")
+    
+    def get_many(self, query: str, doc_keys: list) -> tuple:
+        """
+        Look up cached scores for a batch of documents
+        
+        Returns:
+            (scores, miss_indices): float array with NaN for misses, and the indices still to score
+        """
+        scores = np.full(len(doc_keys), np.nan, dtype=np.float32)
+        miss_indices = []
+        
+        with self.lock:
+            for i, doc_key in enumerate(doc_keys):
+                key = (query, doc_key)
+                score = self.cache.get(key)
+                if score is None:
+                    miss_indices.append(i)
+                else:
+                    self.cache.move_to_end(key)
+                    scores[i] = score
+            
+            self.hits += len(doc_keys) - len(miss_indices)
+            self.misses += len(miss_indices)
+        
+        return scores, miss_indices
+    
+    def score_matrix(self, queries: list, doc_keys: list, score_fn) -> np.ndarray:
+        """
+        Scores of shape (len(queries), len(doc_keys)), computing all misses in one call
+        
+        Args:
+            queries: Query texts (rows)
+            doc_keys: Document hashes (columns)
+            score_fn: Called once as score_fn(rows, cols) with parallel lists of query and
+                      document indices for the uncached pairs; returns their scores
+        """
+        matrix = np.empty((len(queries), len(doc_keys)), dtype=np.float32)
+        
+        miss_rows, miss_cols = [], []
+        for row, query in enumerate(queries):
+            matrix[row], miss_indices = self.get_many(query, doc_keys)
+            miss_rows.extend([row] * len(miss_indices))
+            miss_cols.extend(miss_indices)
+        
+        if miss_cols:
+            matrix[miss_rows, miss_cols] = np.asarray(score_fn(miss_rows, miss_cols), dtype=np.float32)
+            
+            miss_rows = np.asarray(miss_rows)
+            miss_cols = np.asarray(miss_cols)
+            for row in np.unique(miss_rows):
+                cols = miss_cols[miss_rows == row]
+                self.put_many(queries[row], [doc_keys[col] for col in cols], matrix[row, cols])
+        
+        return matrix
+    
+    def put_many(self, query: str, doc_keys: list, scores):
+        """Store scores for a batch of documents, evicting least recently used entries"""
+        with self.lock:
+            for doc_key, score in zip(doc_keys, scores):
+                self.cache[(query, doc_key)] = float(score)
+            while len(self.cache) > self.max_size:
+                self.cache.popitem(last=False)
+    
+    def get_stats(self) -> dict:
+        """Get cache statistics"""
+        total_requests = self.hits + self.misses
+        hit_rate = (self.hits / total_requests * 100) if total_requests > 0 else 0
+        
+        return {
+            'size': len(self.cache),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': f"{hit_rate:.1f}%",
+            'total_requests': total_requests
+        }
+    
+    def clear(self):
+        """Clear all cached scores"""
+        with self.lock:
+            self.cache.clear()
+            self.hits = 0
+            self.misses = 0
+            logger.info("Score cache cleared")
@@ -3,7 +3,7 @@ import logging
 from pathlib import Path
 from typing import Dict, List, Optional
 from datetime import datetime, timezone
-from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo.asynchronous.database import AsyncDatabase
 
 logger = logging.getLogger(__name__)
 
@@ -11,7 +11,7 @@ logger = logging.getLogger(__name__)
 class DocumentCache:
     """Cache manager for tracking document processing state"""
     
-    def __init__(self, db: AsyncIOMotorDatabase):
+    def __init__(self, db: AsyncDatabase):
         self.db = db
         self.collection = db.document_cache
     
@@ -30,21 +30,35 @@ class DocumentCache:
         return await self.collection.find_one({"file_path": file_path}, {"_id": 0})
     
     async def is_document_changed(self, file_path: Path) -> bool:
-        """Check if document has changed since last processing"""
+        """Check if document has changed since last processing
+        
+        Unchanged size and mtime mean unchanged content, so the file is only hashed
+        when its stat differs from the cached one.
+        """
         try:
-            current_hash = self.calculate_file_hash(file_path)
+            import asyncio
+            stat = file_path.stat()
             cached = await self.get_cached_document(str(file_path))
             
             if not cached:
                 return True  # New document
             
-            # Check if hash or file size changed
-            if cached.get('file_hash') != current_hash:
+            if cached.get('file_size') != stat.st_size:
                 return True
             
-            if cached.get('file_size') != file_path.stat().st_size:
+            if cached.get('file_mtime_ns') == stat.st_mtime_ns:
+                return False
+            
+            # Touched (or cached before mtimes were stored): compare contents
+            current_hash = await asyncio.to_thread(self.calculate_file_hash, file_path)
+            if cached.get('file_hash') != current_hash:
                 return True
             
+            # Same content; remember the new mtime so the next pass takes the fast path
+            await self.collection.update_one(
+                {"file_path": str(file_path)},
+                {"$set": {"file_mtime_ns": stat.st_mtime_ns}}
+            )
             return False
         except Exception as e:
             logger.error(f"Error checking document change: {e}")
@@ -53,18 +67,21 @@ class DocumentCache:
     async def update_cache(self, file_path: Path, chunks_count: int, chunk_ids: List[str]):
         """Update cache after successful processing"""
         try:
-            file_hash = self.calculate_file_hash(file_path)
+            import asyncio
+            stat = file_path.stat()
+            file_hash = await asyncio.to_thread(self.calculate_file_hash, file_path)
             
             cache_entry = {
                 "file_path": str(file_path),
                 "file_name": file_path.name,
                 "file_hash": file_hash,
-                "file_size": file_path.stat().st_size,
+                "file_size": stat.st_size,
+                "file_mtime_ns": stat.st_mtime_ns,
                 "file_type": file_path.suffix.lower(),
                 "chunks_count": chunks_count,
                 "chunk_ids": chunk_ids,
-                "processed_at": datetime.now(timezone.utc).isoformat(),
-                "last_modified": datetime.fromtimestamp(file_path.stat().st_mtime, tz=timezone.utc).isoformat()
+                "processed_at": datetime.now(timezone.utc),
+                "last_modified": datetime.fromtimestamp(stat.st_mtime, tz=timezone.utc)
             }
             
             await self.collection.update_one(
@@ -105,7 +122,7 @@ class DocumentCache:
             }
         ]
         
-        result = await self.collection.aggregate(pipeline).to_list(1)
+        result = await (await self.collection.aggregate(pipeline)).to_list(1)
         
         stats = {
             "total_documents": total_docs,
@@ -386,3 +386,25 @@ class OptimizedDocumentProcessor:
             start = max(start + 1, end - self.chunk_overlap)
         
         return chunks
+
+
+# Per-process processor used by the document processing pool (see init_worker)
+_PROCESSOR = None
+
+
+def init_worker():
+    """Pool initializer: build this worker's processor once"""
+    global _PROCESSOR
+    _PROCESSOR = OptimizedDocumentProcessor()
+
+
+def process_document_in_worker(file_path: str) -> List[str]:
+    """Process a document with the worker's own processor
+    
+    Submitted to the pool instead of a bound method, so only the path and the
+    resulting chunks cross the process boundary.
+    """
+    global _PROCESSOR
+    if _PROCESSOR is None:
+        init_worker()
+    return _PROCESSOR.process_document(file_path)
@@ -14,6 +14,29 @@ class EntityExtractor:
         # LAZY LOADING: Only load spaCy when needed to save memory
         self.nlp = None
         self.enable_ner = enable_ner
+        self._ner_attempted = False
+        
+        if enable_ner:
+            self._load_ner_model()
+        else:
+            logger.info("Entity extractor initialized (NER disabled for memory optimization)")
+        
+        # Data patterns for precise extraction
+        self.patterns = {
+            'email': re.compile(r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b'),
+            'phone': re.compile(r'(?:\+33|0)[1-9](?:[\s.-]?\d{2}){4}'),
+            'url': re.compile(r'https?://(?:www\.)?[-a-zA-Z0-9@:%._\+~#=]{1,256}\.[a-zA-Z0-9()]{1,6}\b(?:[-a-zA-Z0-9()@:%_\+.~#?&/=]*)'),
+            'postal_code': re.compile(r'\b\d{5}\b'),
+            'siret': re.compile(r'\b\d{14}\b'),
+            'siren': re.compile(r'\b\d{9}\b'),
+            'reference': re.compile(r'\b[A-Z]{2,4}[-_]?\d{3,8}\b'),
+            'code': re.compile(r'\b[A-Z0-9]{6,12}\b'),
+            'date_fr': re.compile(r'\b\d{1,2}[/-]\d{1,2}[/-]\d{2,4}\b'),
+            'amount': re.compile(r'\b\d+(?:[.,]\d{1,2})?\s?(?:€|EUR|euros?)\b', re.IGNORECASE),
+            'percentage': re.compile(r'\b\d+(?:[.,]\d{1,2})?\s?%\b'),
+        }
+        
+        logger.info("Entity extractor initialized with French NER and data patterns")
     
     def _load_ner_model(self):
         """Lazy load spaCy NER model only when needed"""
@@ -42,30 +65,6 @@ class EntityExtractor:
         except Exception as e:
             logger.error(f"Failed to load spaCy model: {e}")
             self.nlp = None
-
-        self._ner_attempted = False
-        
-        if enable_ner:
-            self._load_ner_model()
-        else:
-            logger.info("Entity extractor initialized (NER disabled for memory optimization)")
-        
-        # Data patterns for precise extraction
-        self.patterns = {
-            'email': re.compile(r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b'),
-            'phone': re.compile(r'(?:\+33|0)[1-9](?:[\s.-]?\d{2}){4}'),
-            'url': re.compile(r'https?://(?:www\.)?[-a-zA-Z0-9@:%._\+~#=]{1,256}\.[a-zA-Z0-9()]{1,6}\b(?:[-a-zA-Z0-9()@:%_\+.~#?&/=]*)'),
-            'postal_code': re.compile(r'\b\d{5}\b'),
-            'siret': re.compile(r'\b\d{14}\b'),
-            'siren': re.compile(r'\b\d{9}\b'),
-            'reference': re.compile(r'\b[A-Z]{2,4}[-_]?\d{3,8}\b'),
-            'code': re.compile(r'\b[A-Z0-9]{6,12}\b'),
-            'date_fr': re.compile(r'\b\d{1,2}[/-]\d{1,2}[/-]\d{2,4}\b'),
-            'amount': re.compile(r'\b\d+(?:[.,]\d{1,2})?\s?(?:€|EUR|euros?)\b', re.IGNORECASE),
-            'percentage': re.compile(r'\b\d+(?:[.,]\d{1,2})?\s?%\b'),
-        }
-        
-        logger.info("Entity extractor initialized with French NER and data patterns")
     
     def extract_entities(self, text: str) -> Dict[str, List[str]]:
         """
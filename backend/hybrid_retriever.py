@@ -2,6 +2,7 @@ import logging
 from typing import List, Dict, Tuple
 from rank_bm25 import BM25Okapi
 import numpy as np
+from cache_manager import content_hash
 
 logger = logging.getLogger(__name__)
 
@@ -84,7 +85,7 @@ class HybridRetriever:
         
         # Process dense results
         for rank, (doc, meta) in enumerate(zip(dense_docs, dense_metadata), start=1):
-            doc_key = doc[:100]  # Use first 100 chars as key
+            doc_key = content_hash(doc)  # Hash of the full chunk text
             if doc_key not in rrf_scores:
                 rrf_scores[doc_key] = 0
                 doc_to_meta[doc_key] = {'doc': doc, 'meta': meta}
@@ -95,7 +96,7 @@ class HybridRetriever:
         
         # Process sparse results
         for rank, (doc, meta) in enumerate(zip(sparse_docs, sparse_metadata), start=1):
-            doc_key = doc[:100]
+            doc_key = content_hash(doc)
             if doc_key not in rrf_scores:
                 rrf_scores[doc_key] = 0
                 doc_to_meta[doc_key] = {'doc': doc, 'meta': meta}
@@ -1,31 +1,35 @@
 import logging
+from dataclasses import dataclass, field
+from functools import cached_property
 from typing import List, Tuple, Optional
 import re
-from spellchecker import SpellChecker
 from rapidfuzz import fuzz, process
-import nltk
-from nltk.corpus import wordnet
 
 logger = logging.getLogger(__name__)
 
+# Common words skipped during synonym expansion
+STOP_WORDS = frozenset({
+    'the', 'a', 'an', 'is', 'are', 'was', 'were', 'be', 'been',
+    'what', 'which', 'who', 'where', 'when', 'how', 'why',
+    'do', 'does', 'did', 'have', 'has', 'had', 'can', 'could',
+    'will', 'would', 'should', 'may', 'might', 'must'
+})
+
+
+@dataclass(slots=True)
+class TokenInfo:
+    """Result of analyzing a single query token (spelling, synonyms, abbreviation)"""
+    original: str
+    corrected: str
+    synonyms: List[str] = field(default_factory=list)
+    abbrev: Optional[str] = None
+
 
 class QueryEnhancer:
     """Enhanced query processing with spell correction, expansion, and fuzzy matching - French-first"""
     
     def __init__(self):
-        # Initialize spell checker (French as primary language)
-        self.spell_checker_fr = SpellChecker(language='fr')
-        self.spell_checker_en = SpellChecker(language='en')
-        
-        # Download NLTK data if not present (for synonyms)
-        try:
-            nltk.data.find('corpora/wordnet.zip')
-        except LookupError:
-            try:
-                nltk.download('wordnet', quiet=True)
-                nltk.download('omw-1.4', quiet=True)
-            except Exception as e:
-                logger.warning(f"Could not download NLTK data: {e}")
+        # Spell checkers and WordNet are loaded lazily on first use (see cached properties below)
         
         # Common technical terms that shouldn't be spell-checked
         self.technical_terms = {
@@ -72,8 +76,43 @@ class QueryEnhancer:
             'kpi': 'key performance indicator',
         }
         
+        # Precompile a single whole-word alternation over all abbreviations (longest first)
+        self._abbrev_re = re.compile(
+            r'\b(?:' + '|'.join(
+                re.escape(abbrev) for abbrev in sorted(self.abbreviations, key=len, reverse=True)
+            ) + r')\b'
+        )
+        
         logger.info("Query enhancer initialized with French-first language support, spell checking and expansion capabilities")
     
+    @cached_property
+    def spell_checker_fr(self):
+        """French spell checker (primary language), loaded on first use"""
+        from spellchecker import SpellChecker
+        return SpellChecker(language='fr')
+    
+    @cached_property
+    def spell_checker_en(self):
+        """English spell checker, loaded on first use"""
+        from spellchecker import SpellChecker
+        return SpellChecker(language='en')
+    
+    @cached_property
+    def _wordnet(self):
+        """WordNet corpus for synonyms, downloading NLTK data on first use if not present"""
+        import nltk
+        try:
+            nltk.data.find('corpora/wordnet.zip')
+        except LookupError:
+            try:
+                nltk.download('wordnet', quiet=True)
+                nltk.download('omw-1.4', quiet=True)
+            except Exception as e:
+                logger.warning(f"Could not download NLTK data: {e}")
+        
+        from nltk.corpus import wordnet
+        return wordnet
+    
     def enhance_query(self, query: str, detect_language: str = 'fr') -> Tuple[str, List[str], Optional[str]]:
         """
         Enhance query with spell correction, expansion, and normalization
@@ -90,28 +129,23 @@ class QueryEnhancer:
         # Step 1: Normalize query
         normalized_query = self._normalize_query(query)
         
-        # Step 2: Detect and correct spelling (defaults to French)
-        corrected_query, corrections_made = self._correct_spelling(normalized_query, detect_language)
+        # Step 2: Analyze every token in a single pass (spelling, synonyms, abbreviations)
+        tokens, corrections_made = self._analyze_tokens(normalized_query, detect_language)
+        corrected_query = ' '.join(token.corrected for token in tokens)
         
         # Step 3: Create suggestion if corrections were made
         suggestion = None
         if corrections_made and corrected_query.lower() != normalized_query.lower():
             suggestion = corrected_query
         
-        # Step 4: Expand query with synonyms and related terms
-        expanded_queries = self._expand_query(corrected_query, detect_language)
-        
-        # Step 5: Add abbreviation expansions (French-first)
-        expanded_queries = self._expand_abbreviations(expanded_queries)
+        # Step 4: Materialize synonym and abbreviation variations from the token analysis
+        expanded_queries = self._build_variations(tokens)
         
-        # Remove duplicates while preserving order
-        seen = set()
-        unique_queries = []
+        # Remove duplicates while preserving order (and casing of first occurrence)
+        seen_map = {}
         for q in expanded_queries:
-            q_lower = q.lower()
-            if q_lower not in seen:
-                seen.add(q_lower)
-                unique_queries.append(q)
+            seen_map.setdefault(q.lower(), q)
+        unique_queries = list(seen_map.values())
         
         logger.info(f"Query enhancement (French-first): '{query}' -> {len(unique_queries)} variations")
         if suggestion:
@@ -131,96 +165,104 @@ class QueryEnhancer:
         
         return query.strip()
     
-    def _correct_spelling(self, query: str, language: str = 'fr') -> Tuple[str, bool]:
+    def _analyze_tokens(self, query: str, language: str = 'fr') -> Tuple[List[TokenInfo], bool]:
         """
-        Correct spelling mistakes in the query
+        Analyze query tokens in one pass: spelling correction, synonyms and abbreviation expansion
         DEFAULT LANGUAGE: French (fr)
+        Note: WordNet is primarily for English; synonyms are only looked up for English queries
         
         Returns:
-            - corrected_query: Query with corrected spelling
-            - corrections_made: True if any corrections were made
+            - tokens: TokenInfo for each whitespace-separated token
+            - corrections_made: True if any spelling corrections were made
         """
         # Select appropriate spell checker (French as default)
         spell_checker = self.spell_checker_fr if language == 'fr' else self.spell_checker_en
+        expand_synonyms = language == 'en'
         
-        # Tokenize query
         words = query.split()
-        corrected_words = []
+        
+        # Find misspelled words with a single bulk lookup
+        # (skips very short words, technical terms and non-alphabetic tokens such as numbers)
+        words_to_check = [
+            word.lower() for word in words
+            if len(word) > 2 and word.isalpha() and word.lower() not in self.technical_terms
+        ]
+        misspelled = spell_checker.unknown(words_to_check) if words_to_check else set()
+        
+        tokens = []
         corrections_made = False
         
         for word in words:
-            # Preserve original if it's a number, very short, or technical term
             word_lower = word.lower()
-            if (len(word) <= 2 or 
-                word.isdigit() or 
-                word_lower in self.technical_terms or
-                not word.isalpha()):
-                corrected_words.append(word)
-                continue
+            corrected = word
             
-            # Check if word is misspelled
-            if word_lower in spell_checker:
-                # Word is correct
-                corrected_words.append(word)
-            else:
+            if word_lower in misspelled:
                 # Word might be misspelled - get correction
                 correction = spell_checker.correction(word_lower)
                 
                 if correction and correction != word_lower:
                     # Use correction but preserve original case pattern
                     if word.isupper():
-                        corrected_words.append(correction.upper())
+                        corrected = correction.upper()
                     elif word[0].isupper():
-                        corrected_words.append(correction.capitalize())
+                        corrected = correction.capitalize()
                     else:
-                        corrected_words.append(correction)
+                        corrected = correction
                     corrections_made = True
                     logger.debug(f"Spelling correction ({language}): '{word}' -> '{correction}'")
-                else:
-                    # Keep original if no good correction found
-                    corrected_words.append(word)
-        
-        corrected_query = ' '.join(corrected_words)
-        return corrected_query, corrections_made
+            
+            corrected_lower = corrected.lower()
+            
+            # Synonyms for content words (limit to top 3)
+            synonyms = []
+            if expand_synonyms and corrected_lower not in STOP_WORDS and len(corrected_lower) > 2:
+                synonyms = self._get_synonyms(corrected_lower)[:3]
+            
+            # Abbreviation expansion (whole word only)
+            abbrev = self._abbrev_re.sub(lambda m: self.abbreviations[m.group(0)], corrected_lower)
+            
+            tokens.append(TokenInfo(
+                original=word,
+                corrected=corrected,
+                synonyms=synonyms,
+                abbrev=abbrev if abbrev != corrected_lower else None
+            ))
+        
+        return tokens, corrections_made
     
-    def _expand_query(self, query: str, language: str = 'fr') -> List[str]:
+    def _build_variations(self, tokens: List[TokenInfo]) -> List[str]:
         """
-        Expand query with synonyms and related terms
-        Note: WordNet is primarily for English; French expansion limited
+        Build query variations from analyzed tokens
         
-        Returns list of query variations
+        Order: corrected query, synonym variations, then abbreviation expansions of each
         """
-        variations = [query]
-        
-        # Only expand English queries with WordNet (WordNet has limited French support)
-        if language != 'en':
-            return variations
-        
-        words = query.lower().split()
-        
-        # Get synonyms for each content word (skip very common words)
-        stop_words = {'the', 'a', 'an', 'is', 'are', 'was', 'were', 'be', 'been',
-                      'what', 'which', 'who', 'where', 'when', 'how', 'why',
-                      'do', 'does', 'did', 'have', 'has', 'had', 'can', 'could',
-                      'will', 'would', 'should', 'may', 'might', 'must'}
-        
-        synonym_map = {}
-        for word in words:
-            if word in stop_words or len(word) <= 2:
-                continue
-            
-            synonyms = self._get_synonyms(word)
-            if synonyms:
-                synonym_map[word] = synonyms[:3]  # Limit to top 3 synonyms
-        
-        # Create variations by replacing words with synonyms
-        if synonym_map:
-            for word, synonyms in synonym_map.items():
-                for synonym in synonyms:
-                    # Create variation by replacing the word
-                    variation = query.lower().replace(word, synonym)
-                    if variation != query.lower():
-                        variations.append(variation)
+        corrected_lower = [token.corrected.lower() for token in tokens]
+        
+        # Synonym variations replace one token at a time (remember which one was swapped)
+        bases = [(corrected_lower, None)]
+        for i, token in enumerate(tokens):
+            for synonym in token.synonyms:
+                bases.append((corrected_lower[:i] + [synonym] + corrected_lower[i + 1:], i))
+        
+        # Group positions sharing the same abbreviation so each expansion yields one variation
+        abbrev_positions = {}
+        for i, token in enumerate(tokens):
+            if token.abbrev is not None:
+                abbrev_positions.setdefault(corrected_lower[i], []).append(i)
+        
+        variations = [' '.join(token.corrected for token in tokens)]
+        variations.extend(' '.join(words) for words, _ in bases[1:])
+        
+        for words, swapped in bases:
+            for positions in abbrev_positions.values():
+                expanded = list(words)
+                changed = False
+                for i in positions:
+                    if i != swapped:
+                        expanded[i] = tokens[i].abbrev
+                        changed = True
+                if changed:
+                    variations.append(' '.join(expanded))
         
         return variations
     
@@ -229,7 +271,7 @@ class QueryEnhancer:
         synonyms = set()
         
         try:
-            for syn in wordnet.synsets(word):
+            for syn in self._wordnet.synsets(word):
                 for lemma in syn.lemmas():
                     synonym = lemma.name().replace('_', ' ')
                     if synonym.lower() != word.lower():
@@ -239,24 +281,6 @@ class QueryEnhancer:
         
         return list(synonyms)
     
-    def _expand_abbreviations(self, queries: List[str]) -> List[str]:
-        """Expand known abbreviations in queries (French-first)"""
-        expanded = list(queries)  # Copy original queries
-        
-        for query in queries:
-            query_lower = query.lower()
-            
-            for abbrev, expansion in self.abbreviations.items():
-                # Check if abbreviation exists as whole word
-                pattern = r'\b' + re.escape(abbrev) + r'\b'
-                if re.search(pattern, query_lower):
-                    # Create variation with expansion
-                    expanded_query = re.sub(pattern, expansion, query_lower, flags=re.IGNORECASE)
-                    if expanded_query not in [q.lower() for q in expanded]:
-                        expanded.append(expanded_query)
-        
-        return expanded
-    
     def fuzzy_match_entities(self, query: str, entity_list: List[str], threshold: int = 80) -> List[Tuple[str, int]]:
         """
         Fuzzy match query against a list of entities (e.g., document names, product names)
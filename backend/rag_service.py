@@ -1,13 +1,288 @@
+import io
 import logging
-from typing import List, Dict, Tuple, Optional
+import random
+import re
+import threading
+import unicodedata
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from functools import lru_cache, wraps
+from typing import AsyncIterator, List, Dict, Tuple, Optional
 import asyncio
+import httpx
+import numpy as np
 from vector_store import VectorStoreService
-from cerebras.cloud.sdk import Cerebras
+from cerebras.cloud.sdk import Cerebras, APIConnectionError, APIStatusError
 from query_enhancer import QueryEnhancer
 from reranker import Reranker
+from cache_manager import AnswerCache, ResponseCache, SemanticCache, content_hash
 
 logger = logging.getLogger(__name__)
 
+# Cerebras model used for answer generation
+LLM_MODEL = "gpt-oss-120b"
+
+# Language indicators (accented characters / common words), compiled once
+FRENCH_ACCENTS = frozenset('àéèêçù')
+FRENCH_WORDS_RE = re.compile(r'\b(?:quoi|quel|quelle|qui|dont|lequel|pourquoi|comment)\b')
+ENGLISH_INDICATORS_RE = re.compile(r'\b(?:the|what|how|why|where|when|who|which|can|could|would|should)\b')
+
+# Reciprocal Rank Fusion constant used when merging variation result lists
+RRF_K = 60
+
+# Notes appended to answers when the question was not asked in French
+NON_FRENCH_NOTE = "\n\n*Note: Ce système répond uniquement en français. Si vous avez posé votre question dans une autre langue, veuillez noter que toutes les réponses sont générées en français.*"
+NON_FRENCH_NOTE_SHORT = "\n\n*Note: Ce système répond uniquement en français.*"
+
+# Separator written between document chunks in the LLM context
+CONTEXT_SEPARATOR = "\n\n" + "=" * 80 + "\n\n"
+
+# Rough characters-per-token ratio used to estimate context size
+CHARS_PER_TOKEN = 4
+
+# Extra instruction inserted when the question was not asked in French
+FRENCH_INSTRUCTION = "\n\n**LANGUE DE RÉPONSE OBLIGATOIRE**: Vous DEVEZ répondre UNIQUEMENT en français, quelle que soit la langue de la question. C'est une exigence absolue du système.\n"
+
+# System prompt pieces, kept as constants so the prefix sent to the LLM is byte-identical across requests
+SYSTEM_PREAMBLE = """Vous êtes un assistant IA expert spécialisé dans la réponse aux questions basées sur le contexte documentaire fourni.
+
+PRINCIPES FONDAMENTAUX:
+1. **ADHÉRENCE STRICTE AU CONTEXTE**: Répondez UNIQUEMENT en utilisant les informations des documents fournis ci-dessous
+2. **PRÉCISION AVANT TOUT**: Si le contexte manque d'informations pertinentes, indiquez explicitement : "Je n'ai pas d'information à ce sujet dans les documents indexés."
+3. **PAS D'HALLUCINATION**: N'inventez jamais, ne supposez jamais et n'utilisez jamais de connaissances externes non présentes dans le contexte
+4. **ATTRIBUTION DES SOURCES**: Référencez les documents spécifiques lors de la fourniture d'informations
+5. **RÉPONSE EN FRANÇAIS UNIQUEMENT**: Vous devez TOUJOURS répondre en français, quelle que soit la langue de la question posée
+6. **CLARTÉ**: Fournissez des réponses claires, concises et bien structurées en français
+7. **ORIENTÉ VERS LES DÉTAILS**: Portez une attention particulière aux détails subtils, aux chiffres spécifiques, aux noms et aux dates dans les documents"""
+
+CONTEXT_HEADER = "\nCONTEXTE DOCUMENTAIRE INDEXÉ:\n"
+
+SYSTEM_EPILOGUE = """
+
+DIRECTIVES DE RÉPONSE:
+- Extrayez et synthétisez les informations pertinentes des documents
+- Citez les sources documentaires lors de votre réponse (par ex., "Selon [Nom du Document]...")
+- Si plusieurs documents contiennent des informations pertinentes, intégrez-les de manière cohérente
+- Pour les questions sur des détails spécifiques (chiffres, noms, dates), soyez extrêmement précis
+- Si la question contient des variations orthographiques ou des synonymes, comprenez l'intention
+- Pour les questions peu claires ou ambiguës, fournissez les informations les plus pertinentes disponibles
+- Maintenez un ton professionnel et utile
+- **IMPORTANT**: Répondez TOUJOURS en français, même si la question est dans une autre langue
+
+Répondez maintenant à la question de l'utilisateur en vous basant uniquement sur le contexte ci-dessus, EN FRANÇAIS."""
+
+
+# LLM call retry policy
+MAX_RETRIES = 3
+MAX_BACKOFF = 8.0
+RETRYABLE_STATUS_CODES = frozenset({429, 500, 502, 503, 504})
+# Retry-After value in an error message: delay-seconds or an HTTP-date ("Wed, 21 Oct 2015 07:28:00 GMT")
+RETRY_AFTER_RE = re.compile(
+    r'retry[-_ ]after["\'\s:=]{0,5}(\w{3}, \d{1,2} \w{3} \d{4} \d{2}:\d{2}:\d{2} GMT|\d+(?:\.\d+)?)',
+    re.IGNORECASE
+)
+
+# Streamed deltas arriving within this window (seconds) are sent to the client as one chunk
+STREAM_FLUSH_INTERVAL = 0.05
+
+
+def _is_quota_error(error_str: str) -> bool:
+    return "quota" in error_str or "429" in error_str or "resource_exhausted" in error_str or "rate" in error_str
+
+
+def _is_auth_error(error_str: str) -> bool:
+    return "unauthorized" in error_str or "401" in error_str or "invalid" in error_str or "authentication" in error_str
+
+
+def _parse_retry_after(value: str) -> Optional[float]:
+    """Seconds to wait for a Retry-After value (delay-seconds or HTTP-date), None if unparseable"""
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+def _retry_after_seconds(error: Exception) -> Optional[float]:
+    """Retry-After hint from the response header, or from the error message"""
+    response = getattr(error, 'response', None)
+    header = response.headers.get('retry-after') if response is not None else None
+    if header:
+        seconds = _parse_retry_after(header.strip())
+        if seconds is not None:
+            return seconds
+    
+    match = RETRY_AFTER_RE.search(str(error))
+    return _parse_retry_after(match.group(1)) if match else None
+
+
+def _is_retryable_llm_error(error: Exception) -> bool:
+    """
+    Only transient failures are retried: 429, 5xx, timeouts and dropped connections.
+    Other 4xx (bad request, auth) and unknown errors fail fast.
+    """
+    if isinstance(error, (APIConnectionError, httpx.TimeoutException, httpx.ConnectError, httpx.RemoteProtocolError)):
+        return True
+    if isinstance(error, APIStatusError):
+        return error.status_code in RETRYABLE_STATUS_CODES
+    return False
+
+
+def retry_with_backoff(max_retries: int = MAX_RETRIES, base_delay: float = 1.0, retry_if=None):
+    """
+    Retry an async function with full-jitter exponential backoff (capped at MAX_BACKOFF)
+    
+    A Retry-After hint takes precedence over the computed delay; a hint longer than MAX_BACKOFF
+    fails fast instead of stalling the request. Errors rejected by retry_if (or raised on the
+    last attempt) propagate unchanged.
+    """
+    def decorator(func):
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            for attempt in range(max_retries):
+                try:
+                    return await func(*args, **kwargs)
+                except Exception as e:
+                    if attempt >= max_retries - 1 or (retry_if and not retry_if(e)):
+                        raise
+                    
+                    wait_time = _retry_after_seconds(e)
+                    if wait_time is None:
+                        # Full jitter avoids synchronized retries against a shared endpoint
+                        wait_time = random.uniform(0, min(MAX_BACKOFF, base_delay * (2 ** attempt)))
+                    elif wait_time > MAX_BACKOFF:
+                        raise
+                    logger.warning(f"Error on attempt {attempt + 1}, retrying in {wait_time:.1f}s: {e}")
+                    await asyncio.sleep(wait_time)
+        return wrapper
+    return decorator
+
+
+def _normalize_query_key(query: str) -> str:
+    """Canonical form of a query for caching: NFKC, trimmed, whitespace collapsed (case is kept for entity matching)"""
+    return ' '.join(unicodedata.normalize('NFKC', query).split())
+
+
+def rrf_fuse(key_lists: List[np.ndarray], k: int = RRF_K) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Reciprocal Rank Fusion over ranked lists of chunk keys: score(d) = sum(1 / (k + rank(d)))
+    
+    Returns the unique keys (best first; ties keep first-seen order) and their fused scores.
+    """
+    if not key_lists:
+        return np.empty(0, dtype=np.uint64), np.empty(0, dtype=float)
+    
+    keys = np.concatenate(key_lists)
+    ranks = np.concatenate([np.arange(1, len(key_list) + 1) for key_list in key_lists])
+    
+    unique_keys, first_seen, inverse = np.unique(keys, return_index=True, return_inverse=True)
+    scores = np.bincount(inverse, weights=1.0 / (k + ranks), minlength=len(unique_keys))
+    
+    order = np.lexsort((first_seen, -scores))
+    return unique_keys[order], scores[order]
+
+
+def merge_variation_results(results: List[Tuple[List[str], List[Dict]]]) -> Tuple[List[str], List[Dict]]:
+    """
+    Fuse per-variation (documents, metadata) lists with Reciprocal Rank Fusion
+    
+    Chunks are identified by a hash of their full text (file names are not unique across
+    subfolders), so a chunk ranked by several variations accumulates evidence instead of
+    being dropped as a duplicate. Each kept metadata dict gets its fusion_score.
+    """
+    merged = {}
+    key_lists = []
+    for docs, meta in results:
+        keys = np.fromiter((content_hash(doc) for doc in docs), dtype=np.uint64, count=len(docs))
+        key_lists.append(keys)
+        
+        # Keep the most relevant copy of each chunk
+        for key, doc, doc_meta in zip(keys.tolist(), docs, meta):
+            existing = merged.get(key)
+            if existing is None or doc_meta.get('relevance_score', 0) > existing[1].get('relevance_score', 0):
+                merged[key] = (doc, doc_meta)
+    
+    fused_keys, fused_scores = rrf_fuse(key_lists)
+    
+    unique_docs = []
+    unique_metadata = []
+    for key, score in zip(fused_keys.tolist(), fused_scores.tolist()):
+        doc, doc_meta = merged[key]
+        doc_meta['fusion_score'] = score
+        unique_docs.append(doc)
+        unique_metadata.append(doc_meta)
+    
+    return unique_docs, unique_metadata
+
+
+@lru_cache(maxsize=4)
+def _get_client(api_key: str) -> Cerebras:
+    """Get a shared Cerebras client per API key (reuses its HTTP connection pool across requests)"""
+    logger.debug("Created new Cerebras client")
+    return Cerebras(api_key=api_key)
+
+
+@dataclass(slots=True)
+class RetrievedDoc:
+    """A retrieved chunk with the metadata fields used for context building and sources"""
+    text: str
+    source: str
+    chunk_index: int
+    relevance: float
+    reranker_score: float
+    retrieval_method: str
+    
+    @classmethod
+    def from_metadata(cls, text: str, meta: Dict) -> "RetrievedDoc":
+        """Build from a document and its metadata dict (single pass over dict lookups)"""
+        return cls(
+            text=text,
+            source=meta.get('source', 'Unknown'),
+            chunk_index=meta.get('chunk_index', 0),
+            relevance=meta.get('relevance_score', 0),
+            reranker_score=meta.get('reranker_score', 0),
+            retrieval_method=meta.get('retrieval_method', 'dense')
+        )
+    
+    @staticmethod
+    def to_sources(docs: List["RetrievedDoc"]) -> List[Dict]:
+        """Source entries returned to the client (scores rounded once per field, vectorized)"""
+        relevance = np.fromiter((doc.relevance for doc in docs), dtype=float, count=len(docs)).round(3)
+        reranker = np.fromiter((doc.reranker_score for doc in docs), dtype=float, count=len(docs)).round(3)
+        
+        return [
+            {
+                "source": doc.source,
+                "chunk_index": doc.chunk_index,
+                "relevance_score": rel,
+                "reranker_score": rr,
+                "retrieval_method": doc.retrieval_method
+            }
+            for doc, rel, rr in zip(docs, relevance.tolist(), reranker.tolist())
+        ]
+
+
+@dataclass(slots=True)
+class PreparedQuery:
+    """Everything resolved before generation: the prompt to send, or a final answer when no LLM call is needed"""
+    corrected_query: str
+    spelling_suggestion: Optional[str]
+    is_non_french_query: bool
+    query_embedding: Optional[np.ndarray] = None
+    sources: List[Dict] = field(default_factory=list)
+    retrieved: List[RetrievedDoc] = field(default_factory=list)
+    system_message: Optional[str] = None
+    response: Optional[str] = None
+    query_key: str = ''
+    cache_tag: Tuple = ()
+
 
 class RAGService:
     """Enhanced RAG service with query enhancement, hybrid retrieval, and reranking - FRENCH-FIRST"""
@@ -20,42 +295,84 @@ class RAGService:
         # Initialize OPTIMIZED components
         self.query_enhancer = QueryEnhancer()
         
-        # Use optimized reranker with exact match boosting (lightweight model)
+        # Enhancement results per normalized query (spell check + expansion is deterministic)
+        self._enhance_cached = lru_cache(maxsize=4096)(self._enhance_query)
+        
+        # Use optimized reranker with exact match boosting (multilingual BGE cross-encoder)
         try:
             from reranker_optimized import RerankerOptimized
-            # Use lightweight model by default to prevent memory issues
-            self.reranker = RerankerOptimized(model_name='cross-encoder/ms-marco-MiniLM-L-6-v2')
+            self.reranker = RerankerOptimized(model_name='BAAI/bge-reranker-v2-m3', max_length=256)
             logger.info("Using OPTIMIZED reranker with exact match boosting")
         except Exception as e:
             logger.warning(f"Could not load optimized reranker: {e}, falling back to standard")
             self.reranker = Reranker(model_name='cross-encoder/ms-marco-MiniLM-L-6-v2')
         
         # OPTIMIZED Configuration for speed and precision
-        self.max_retries = 3
+        self.max_retries = MAX_RETRIES
         self.initial_retrieval_count = 15  # Reduced from 20 for speed (cache helps)
         self.final_results_count = 8  # Return top 8 after reranking
+        self.max_rerank_candidates = 16  # Cap cross-encoder input (fused order keeps the best candidates)
         self.min_reranker_score = -3.0  # Stricter threshold for precision
+        self.bm25_dominance_score = 8.0  # Skip reranking when the top BM25 score exceeds this...
+        self.bm25_dominance_ratio = 2.0  # ...and is at least this many times the runner-up
+        self.relevance_threshold = 0.3  # Minimum cosine similarity for dense hits (applied inside the vector store)
         self.max_context_tokens = 8000
         
-        logger.info("OPTIMIZED RAG service initialized with CamemBERT, caching, and exact match boosting")
+        # Tokenizer used to enforce the context budget (chars / CHARS_PER_TOKEN estimate if unavailable)
+        try:
+            import tiktoken
+            self._enc = tiktoken.get_encoding("cl100k_base")
+        except Exception as e:
+            logger.warning(f"tiktoken unavailable ({e}), estimating context tokens from character count")
+            self._enc = None
+        
+        # Generated answers keyed by (model, system prompt, query); the system prompt embeds the
+        # retrieved context, so re-indexed documents naturally produce a different key
+        self._llm_cache_ttl = 3600
+        self._llm_cache = ResponseCache(max_size=256, ttl_seconds=self._llm_cache_ttl)
+        
+        # Full answers for paraphrased questions, matched by query embedding similarity
+        self._semantic_cache = SemanticCache(max_size=512, similarity_threshold=0.93, ttl_seconds=self._llm_cache_ttl)
+        
+        # Full answers for repeated questions, checked before any embedding or retrieval work.
+        # Answer caches are tagged with the index version so a reindex invalidates them.
+        self._answer_cache = AnswerCache(max_size=1024, ttl_seconds=900)
+        
+        logger.info("OPTIMIZED RAG service initialized with cross-encoder reranking, caching, and exact match boosting")
     
     def update_api_key(self, api_key: str):
         """Update the API key for Cerebras"""
         self.api_key = api_key
     
+    def warmup(self):
+        """
+        Prime the query path off the request path: load lazy spell checker dictionaries,
+        run one embedding and one reranker forward pass (tokenizers, kernels, allocator)
+        """
+        try:
+            self.query_enhancer.enhance_query("Préchauffage du service", detect_language='fr')
+            self.vector_service.embed_query("Préchauffage du service")
+            self.reranker.rerank("warmup", ["Lorem ipsum."], [{"source": "init"}], top_k=1)
+            logger.info("RAG service warmed up (query enhancer, embedder, reranker)")
+        except Exception as e:
+            logger.warning(f"RAG service warmup failed: {e}")
+    
     def _detect_language(self, query: str) -> str:
         """
         Simple language detection (French as default, with English support)
-        French is the PRIMARY language - defaults to 'fr'
+        French is the PRIMARY language - only returns 'en' when English indicators
+        are found and no French ones
         """
-        # Count French-specific characters and common words
-        french_indicators = ['à', 'é', 'è', 'ê', 'ç', 'ù', 'où', 'quoi', 'quel', 'quelle', 'qui', 'dont', 'lequel']
         text_lower = query.lower()
         
-        french_count = sum(1 for indicator in french_indicators if indicator in text_lower)
+        # One set check for accents, then single regex scans that stop at the first hit
+        has_french = not FRENCH_ACCENTS.isdisjoint(text_lower) or FRENCH_WORDS_RE.search(text_lower) is not None
+        has_english = not has_french and ENGLISH_INDICATORS_RE.search(text_lower) is not None
+        
+        language = 'en' if has_english else 'fr'
+        logger.info(f"Query language check: French indicators={has_french}, English indicators={has_english}, detected={language}")
         
-        # Always default to French - system is French-first
-        return 'fr'
+        return language
     
     async def get_response(
         self,
@@ -72,239 +389,457 @@ class RAGService:
             - sources: List of source documents with metadata
             - spelling_suggestion: "Did you mean...?" suggestion if applicable
         """
+        prepared = await self._prepare_query(query)
+        if prepared.response is not None:
+            return prepared.response, prepared.sources, prepared.spelling_suggestion
         
-        # Detect if query is in non-French language (for adding note in response)
-        french_indicators = ['à', 'é', 'è', 'ê', 'ç', 'ù', 'où', 'quoi', 'quel', 'quelle', 'qui', 'dont', 'lequel', 'pourquoi', 'comment']
-        english_indicators = ['the', 'what', 'how', 'why', 'where', 'when', 'who', 'which', 'can', 'could', 'would', 'should']
-        text_lower = query.lower()
+        # Step 6: GENERATE RESPONSE (ALWAYS IN FRENCH)
+        response = self._llm_cache.get(LLM_MODEL, prepared.system_message, prepared.corrected_query)
+        llm_task = None
+        if response is None:
+            llm_task = asyncio.create_task(
+                self._generate_response(api_key, prepared.system_message, prepared.corrected_query)
+            )
+            # Let the task dispatch the request so the sources below are built while it is in flight
+            await asyncio.sleep(0)
+        else:
+            logger.info("Returning cached LLM response")
         
-        french_count = sum(1 for indicator in french_indicators if indicator in text_lower)
-        english_count = sum(1 for indicator in english_indicators if ' ' + indicator + ' ' in ' ' + text_lower + ' ')
+        prepared.sources = RetrievedDoc.to_sources(prepared.retrieved)
+        
+        if llm_task is not None:
+            try:
+                response = await llm_task
+            except Exception as e:
+                raise self._llm_error(e)
+            self._llm_cache.put(LLM_MODEL, prepared.system_message, prepared.corrected_query, response)
         
-        is_non_french_query = (english_count > 0 and french_count == 0)
-        logger.info(f"Query language check: French indicators={french_count}, English indicators={english_count}, Will add French-only note={is_non_french_query}")
+        response = self._complete_response(prepared, response)
         
-        # Step 1: QUERY ENHANCEMENT - Spell correction and expansion (French-first)
-        corrected_query, query_variations, spelling_suggestion = self.query_enhancer.enhance_query(
-            query, detect_language='fr'  # Always use French for query enhancement
+        logger.info(f"Successfully generated French response for session {session_id}")
+        return response, prepared.sources, prepared.spelling_suggestion
+    
+    async def get_response_stream(
+        self,
+        query: str,
+        session_id: str,
+        api_key: str,
+        chat_history: List[Dict] = None
+    ) -> Tuple[AsyncIterator[str], List[Dict], Optional[str]]:
+        """
+        Streaming variant of get_response - ALWAYS RESPONDS IN FRENCH
+        
+        Retrieval runs before this returns, so sources are available before the first token.
+        
+        Returns:
+            - chunks: Async iterator of response text chunks (cached answers arrive as one chunk)
+            - sources: List of source documents with metadata
+            - spelling_suggestion: "Did you mean...?" suggestion if applicable
+        """
+        prepared = await self._prepare_query(query)
+        if prepared.response is None:
+            prepared.sources = RetrievedDoc.to_sources(prepared.retrieved)
+        return self._stream_answer(prepared, api_key, session_id), prepared.sources, prepared.spelling_suggestion
+    
+    async def _stream_answer(self, prepared: PreparedQuery, api_key: str, session_id: str) -> AsyncIterator[str]:
+        """Yield the answer text as it is generated, then the French-only note if needed"""
+        if prepared.response is not None:
+            yield prepared.response
+            return
+        
+        response = self._llm_cache.get(LLM_MODEL, prepared.system_message, prepared.corrected_query)
+        if response is not None:
+            logger.info("Returning cached LLM response")
+            yield self._complete_response(prepared, response)
+            return
+        
+        parts = []
+        try:
+            async for delta in self._stream_completion(api_key, prepared.system_message, prepared.corrected_query):
+                parts.append(delta)
+                yield delta
+        except Exception as e:
+            raise self._llm_error(e)
+        
+        response = ''.join(parts)
+        self._llm_cache.put(LLM_MODEL, prepared.system_message, prepared.corrected_query, response)
+        
+        completed = self._complete_response(prepared, response)
+        if len(completed) > len(response):
+            yield completed[len(response):]
+        
+        logger.info(f"Successfully streamed French response for session {session_id}")
+    
+    def _complete_response(self, prepared: PreparedQuery, response: str) -> str:
+        """Append the French-only note if needed and remember the answer for paraphrased questions"""
+        # Add French-only note if query was in another language
+        if prepared.is_non_french_query:
+            response += NON_FRENCH_NOTE
+        
+        self._semantic_cache.put(prepared.query_embedding, (response, prepared.sources), tag=prepared.cache_tag)
+        self._answer_cache.put(
+            prepared.query_key,
+            (prepared.corrected_query, prepared.spelling_suggestion, response, prepared.sources),
+            tag=prepared.cache_tag
         )
+        return response
+    
+    def _rank_by_dominant_bm25(
+        self,
+        documents: List[str],
+        metadata: List[Dict]
+    ) -> Optional[Tuple[List[str], List[Dict]]]:
+        """
+        Order candidates by BM25 when the top keyword match dominates, else return None
+        
+        reranker_score is set to bm25_score / max_bm25 so the dynamic threshold still applies.
+        """
+        if not metadata:
+            return None
+        
+        bm25 = np.fromiter((meta.get('bm25_score', 0.0) for meta in metadata), dtype=float, count=len(metadata))
+        top = bm25.max()
+        second = np.partition(bm25, -2)[-2] if bm25.size > 1 else 0.0
+        if top <= self.bm25_dominance_score or top < self.bm25_dominance_ratio * second:
+            return None
+        
+        normalized = bm25 / top
+        order = np.argsort(-normalized, kind='stable')[:self.initial_retrieval_count]
+        for i in order:
+            metadata[i]['reranker_score'] = float(normalized[i])
+        
+        return [documents[i] for i in order], [metadata[i] for i in order]
+    
+    def _enhance_query(self, query: str) -> Tuple[str, List[str], Optional[str]]:
+        """Spell correction and expansion (French-first); memoized per instance as _enhance_cached"""
+        return self.query_enhancer.enhance_query(query, detect_language='fr')  # Always use French for query enhancement
+    
+    async def _prepare_query(self, query: str) -> PreparedQuery:
+        """Run query enhancement, retrieval, reranking and prompt building (steps 1-5)"""
+        
+        # Detect if query is in non-French language (for adding note in response)
+        is_non_french_query = self._detect_language(query) != 'fr'
+        query_key = _normalize_query_key(query)
+        cache_tag = (is_non_french_query, self.vector_service.collection_version)
+        
+        # Same question already answered against the current index?
+        cached = self._answer_cache.get(query_key, tag=cache_tag)
+        if cached is not None:
+            logger.info("Returning cached response")
+            corrected_query, spelling_suggestion, response, sources = cached
+            return PreparedQuery(corrected_query, spelling_suggestion, is_non_french_query, sources=sources, response=response)
+        
+        # Step 1: QUERY ENHANCEMENT - Spell correction and expansion (French-first)
+        corrected_query, query_variations, spelling_suggestion = self._enhance_cached(query_key)
         
         if spelling_suggestion:
             logger.info(f"Spelling correction applied: '{query}' -> '{spelling_suggestion}'")
         
-        # Attempt with exponential backoff
-        for attempt in range(self.max_retries):
-            try:
-                # Step 2: HYBRID RETRIEVAL - Search with multiple query variations
-                all_docs = []
-                all_metadata = []
-                
-                # Search with original corrected query (most important)
-                docs, meta = self.vector_service.search(
-                    corrected_query, 
-                    n_results=self.initial_retrieval_count,
-                    use_hybrid=True
-                )
-                all_docs.extend(docs)
-                all_metadata.extend(meta)
-                
-                # Also search with top query variations (for better coverage)
-                for variation in query_variations[1:min(3, len(query_variations))]:
-                    if variation.lower() != corrected_query.lower():
-                        docs_var, meta_var = self.vector_service.search(
-                            variation,
-                            n_results=5,  # Fewer results from variations
-                            use_hybrid=True
-                        )
-                        all_docs.extend(docs_var)
-                        all_metadata.extend(meta_var)
-                
-                # Remove duplicates while preserving metadata
-                unique_docs = []
-                unique_metadata = []
-                seen = set()
-                
-                for doc, meta in zip(all_docs, all_metadata):
-                    doc_key = doc[:100]  # Use first 100 chars as key
-                    if doc_key not in seen:
-                        seen.add(doc_key)
-                        unique_docs.append(doc)
-                        unique_metadata.append(meta)
-                
-                logger.info(f"Retrieved {len(unique_docs)} unique documents from hybrid search")
-                
-                if not unique_docs:
-                    # No documents found
-                    logger.warning(f"No relevant documents found for query: {query[:50]}...")
-                    response = self._handle_no_documents_found(query)
-                    if is_non_french_query:
-                        response += "\n\n*Note: Ce système répond uniquement en français.*"
-                    return response, [], spelling_suggestion
-                
-                # Step 3: OPTIMIZED RERANKING - CamemBERT + exact match boosting
-                reranked_docs, reranked_metadata = self.reranker.rerank(
-                    corrected_query,
-                    unique_docs,
-                    unique_metadata,
+        # Near-duplicate question already answered? (tagged by language note and index version)
+        query_embedding = await asyncio.to_thread(self.vector_service.embed_query, corrected_query)
+        cached = self._semantic_cache.get(query_embedding, tag=cache_tag)
+        if cached is not None:
+            logger.info("Returning semantically cached response")
+            response, sources = cached
+            return PreparedQuery(corrected_query, spelling_suggestion, is_non_french_query, sources=sources, response=response)
+        
+        # Step 2: HYBRID RETRIEVAL - Search the corrected query and top variations concurrently
+        searches = [(corrected_query, self.initial_retrieval_count)]
+        searches.extend(
+            (variation, 5)  # Fewer results from variations
+            for variation in query_variations[1:min(3, len(query_variations))]
+            if variation.lower() != corrected_query.lower()
+        )
+        
+        results = await asyncio.gather(*(
+            self.vector_service.search_async(
+                search_query,
+                n_results=n_results,
+                use_hybrid=True,
+                score_cutoff=self.relevance_threshold
+            )
+            for search_query, n_results in searches
+        ))
+        
+        # Fuse the result lists with Reciprocal Rank Fusion
+        unique_docs, unique_metadata = merge_variation_results(results)
+        
+        logger.info(f"Retrieved {len(unique_docs)} unique documents from hybrid search")
+        
+        if not unique_docs:
+            # No documents found
+            logger.warning(f"No relevant documents found for query: {query[:50]}...")
+            response = self._handle_no_documents_found(query)
+            if is_non_french_query:
+                response += NON_FRENCH_NOTE_SHORT
+            return PreparedQuery(corrected_query, spelling_suggestion, is_non_french_query, response=response)
+        
+        # Step 3: OPTIMIZED RERANKING - cross-encoder + exact match boosting, scoring the candidates
+        # against the corrected query and the searched variations in one batch (best score per doc)
+        # (skipped when one keyword match clearly dominates: the cross-encoder would not change the answer)
+        if len(unique_docs) <= self.final_results_count:
+            # Every candidate fits in the final set anyway: skip the cross-encoder and keep fusion order
+            logger.info(f"Skipped reranker: fast_path=True ({len(unique_docs)} candidates <= {self.final_results_count})")
+            filtered_docs, filtered_metadata = unique_docs, unique_metadata
+        else:
+            candidate_docs = unique_docs[:self.max_rerank_candidates]
+            candidate_metadata = unique_metadata[:self.max_rerank_candidates]
+            
+            dominant = self._rank_by_dominant_bm25(candidate_docs, candidate_metadata)
+            if dominant is not None:
+                logger.info("Skipped reranker: dominant BM25 match")
+                reranked_docs, reranked_metadata = dominant
+            else:
+                reranked_docs, reranked_metadata = self.reranker.rerank_multi_query(
+                    [search_query for search_query, _ in searches],
+                    candidate_docs,
+                    candidate_metadata,
                     top_k=self.initial_retrieval_count,
                     enable_exact_match_boost=True  # Boost for names and data
                 )
-                
-                # Step 4: STRICTER DYNAMIC THRESHOLD - Better precision (20th percentile)
-                if reranked_metadata:
-                    scores = [meta.get('reranker_score', 0.0) for meta in reranked_metadata]
-                    # Use 20th percentile (stricter) for better precision on details
-                    dynamic_threshold = self.reranker.compute_dynamic_threshold(scores, percentile=20)
-                    
-                    # Apply filter with dynamic threshold
-                    filtered_docs, filtered_metadata = self.reranker.filter_by_confidence(
-                        reranked_docs,
-                        reranked_metadata,
-                        min_score=max(self.min_reranker_score, dynamic_threshold),
-                        use_dynamic_threshold=True
-                    )
-                else:
-                    filtered_docs, filtered_metadata = reranked_docs, reranked_metadata
-                
-                # Take top N results
-                final_docs = filtered_docs[:self.final_results_count]
-                final_metadata = filtered_metadata[:self.final_results_count]
-                
-                if not final_docs:
-                    # All documents below confidence threshold
-                    logger.warning(f"All retrieved documents below confidence threshold")
-                    response = self._handle_low_relevance(query)
-                    if is_non_french_query:
-                        response += "\n\n*Note: Ce système répond uniquement en français.*"
-                    return response, [], spelling_suggestion
-                
-                logger.info(f"Final result set: {len(final_docs)} documents after reranking and filtering")
-                
-                # Step 5: BUILD CONTEXT
-                context = self._build_optimized_context(final_docs, final_metadata)
-                
-                # Prepare sources for response
-                sources = [
-                    {
-                        "source": meta.get('source', 'Unknown'),
-                        "chunk_index": meta.get('chunk_index', 0),
-                        "relevance_score": round(meta.get('relevance_score', 0), 3),
-                        "reranker_score": round(meta.get('reranker_score', 0), 3),
-                        "retrieval_method": meta.get('retrieval_method', 'dense')
-                    }
-                    for meta in final_metadata
-                ]
-                
-                # Step 6: GENERATE RESPONSE (ALWAYS IN FRENCH)
-                system_message = self._build_system_prompt(context, corrected_query, is_non_french_query)
-                
-                # Call Cerebras LLM with gpt-oss-120b model
-                client = Cerebras(api_key=api_key)
-                
-                chat_completion = await asyncio.to_thread(
-                    client.chat.completions.create,
-                    messages=[
-                        {"role": "system", "content": system_message},
-                        {"role": "user", "content": corrected_query}
-                    ],
-                    model="gpt-oss-120b",  # Changed from llama-3.3-70b to gpt-oss-120b
-                    max_completion_tokens=2048,
-                    temperature=0.7,
-                    top_p=1
-                )
-                
-                response = chat_completion.choices[0].message.content
-                
-                # Add French-only note if query was in another language
-                if is_non_french_query:
-                    response += "\n\n*Note: Ce système répond uniquement en français. Si vous avez posé votre question dans une autre langue, veuillez noter que toutes les réponses sont générées en français.*"
-                
-                logger.info(f"Successfully generated French response for session {session_id} (attempt {attempt + 1})")
-                return response, sources, spelling_suggestion
             
-            except Exception as e:
-                error_str = str(e).lower()
+            # Step 4: STRICTER DYNAMIC THRESHOLD - Better precision (20th percentile)
+            # Scores are extracted once into an array; threshold and selection are single vector ops
+            scores = np.fromiter(
+                (meta.get('reranker_score', 0.0) for meta in reranked_metadata),
+                dtype=float,
+                count=len(reranked_metadata)
+            )
+            if scores.size:
+                # Use 20th percentile (stricter) for better precision on details
+                dynamic_threshold = self.reranker.compute_dynamic_threshold(scores, percentile=20)
+                threshold = max(self.min_reranker_score, dynamic_threshold)
                 
-                # Check if it's a quota/rate limit error
-                if "quota" in error_str or "429" in error_str or "resource_exhausted" in error_str or "rate" in error_str:
-                    logger.error(f"API quota exceeded: {e}")
-                    raise Exception(
-                        "La limite de débit de l'API Cerebras a été dépassée. Veuillez réessayer plus tard ou vérifier les détails de facturation de votre clé API sur "
-                        "https://cloud.cerebras.ai"
-                    )
+                keep = np.flatnonzero(scores >= threshold)
+                filtered_docs = [reranked_docs[i] for i in keep]
+                filtered_metadata = [reranked_metadata[i] for i in keep]
+                logger.info(f"Filtered {len(reranked_docs)} documents by threshold={threshold:.3f} -> {len(filtered_docs)} kept")
+            else:
+                filtered_docs, filtered_metadata = reranked_docs, reranked_metadata
+        
+        # Take top N results
+        final_docs = filtered_docs[:self.final_results_count]
+        final_metadata = filtered_metadata[:self.final_results_count]
+        
+        if not final_docs:
+            # All documents below confidence threshold
+            logger.warning(f"All retrieved documents below confidence threshold")
+            response = self._handle_low_relevance(query)
+            if is_non_french_query:
+                response += NON_FRENCH_NOTE_SHORT
+            return PreparedQuery(corrected_query, spelling_suggestion, is_non_french_query, response=response)
+        
+        logger.info(f"Final result set: {len(final_docs)} documents after reranking and filtering")
+        
+        # Step 5: BUILD CONTEXT (pack metadata once, reuse for context and sources)
+        retrieved = [
+            RetrievedDoc.from_metadata(doc, meta)
+            for doc, meta in zip(final_docs, final_metadata)
+        ]
+        retrieved = self._fit_context_budget(retrieved)
+        context = self._build_optimized_context(retrieved)
+        
+        # Sources are built by the caller (overlapped with the LLM call in get_response)
+        
+        # System prompt for generation (ALWAYS IN FRENCH)
+        system_message = self._build_system_prompt(context, corrected_query, is_non_french_query)
+        
+        return PreparedQuery(
+            corrected_query,
+            spelling_suggestion,
+            is_non_french_query,
+            query_embedding=query_embedding,
+            retrieved=retrieved,
+            system_message=system_message,
+            query_key=query_key,
+            cache_tag=cache_tag
+        )
+    
+    def _completion_kwargs(self, system_message: str, query: str) -> Dict:
+        """Chat completion parameters shared by the blocking and streaming calls"""
+        return dict(
+            messages=[
+                {"role": "system", "content": system_message},
+                {"role": "user", "content": query}
+            ],
+            model=LLM_MODEL,
+            max_completion_tokens=2048,
+            temperature=0.7,
+            top_p=1
+        )
+    
+    @retry_with_backoff(max_retries=MAX_RETRIES, retry_if=_is_retryable_llm_error)
+    async def _generate_response(self, api_key: str, system_message: str, query: str) -> str:
+        """Call Cerebras LLM with gpt-oss-120b model (retried with jittered backoff)"""
+        client = _get_client(api_key)
+        
+        chat_completion = await asyncio.to_thread(
+            client.chat.completions.create,
+            **self._completion_kwargs(system_message, query)
+        )
+        
+        return chat_completion.choices[0].message.content
+    
+    @retry_with_backoff(max_retries=MAX_RETRIES, retry_if=_is_retryable_llm_error)
+    async def _open_stream(self, api_key: str, system_message: str, query: str):
+        """Open a streaming Cerebras completion (only opening is retried, not a partially consumed stream)"""
+        client = _get_client(api_key)
+        
+        return await asyncio.to_thread(
+            client.chat.completions.create,
+            stream=True,
+            **self._completion_kwargs(system_message, query)
+        )
+    
+    async def _stream_completion(self, api_key: str, system_message: str, query: str) -> AsyncIterator[str]:
+        """Yield text deltas from a streaming completion (the blocking iterator runs in a worker thread)"""
+        stream = await self._open_stream(api_key, system_message, query)
+        
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+        stop = threading.Event()
+        done = object()
+        
+        def pump():
+            try:
+                for chunk in stream:
+                    if stop.is_set():
+                        break
+                    delta = chunk.choices[0].delta.content if chunk.choices else None
+                    if delta:
+                        loop.call_soon_threadsafe(queue.put_nowait, delta)
+            except Exception as e:
+                loop.call_soon_threadsafe(queue.put_nowait, e)
+            finally:
+                loop.call_soon_threadsafe(queue.put_nowait, done)
+        
+        pump_task = asyncio.ensure_future(asyncio.to_thread(pump))
+        try:
+            # The first delta goes out immediately; later ones are coalesced into
+            # STREAM_FLUSH_INTERVAL windows so the client isn't sent one tiny chunk per token
+            pending = []
+            last_flush = loop.time() - STREAM_FLUSH_INTERVAL
+            while True:
+                if pending:
+                    try:
+                        item = await asyncio.wait_for(
+                            queue.get(), max(last_flush + STREAM_FLUSH_INTERVAL - loop.time(), 0)
+                        )
+                    except asyncio.TimeoutError:
+                        item = None
+                else:
+                    item = await queue.get()
                 
-                # Check if it's an authentication error
-                if "unauthorized" in error_str or "401" in error_str or "invalid" in error_str or "authentication" in error_str:
-                    logger.error(f"API authentication failed: {e}")
-                    raise Exception(
-                        "Clé API invalide ou non autorisée. Veuillez vérifier votre clé API Cerebras dans les Paramètres. "
-                        "Obtenez une clé valide depuis https://cloud.cerebras.ai"
-                    )
+                if item is done or isinstance(item, Exception):
+                    if pending:
+                        yield ''.join(pending)
+                    if item is done:
+                        break
+                    raise item
                 
-                # For other errors, retry with exponential backoff
-                if attempt < self.max_retries - 1:
-                    wait_time = 2 ** attempt  # Exponential backoff: 1s, 2s, 4s
-                    logger.warning(f"Error on attempt {attempt + 1}, retrying in {wait_time}s: {e}")
-                    await asyncio.sleep(wait_time)
-                else:
-                    logger.error(f"Error in RAG service after {self.max_retries} attempts: {e}")
-                    raise Exception(f"Échec de génération de réponse après {self.max_retries} tentatives: {str(e)}")
+                if item is not None:
+                    pending.append(item)
+                if loop.time() - last_flush >= STREAM_FLUSH_INTERVAL:
+                    yield ''.join(pending)
+                    pending.clear()
+                    last_flush = loop.time()
+        finally:
+            # Consumer went away (e.g. client disconnected): let the worker stop at the next chunk
+            stop.set()
+            if pump_task.done():
+                await pump_task
+    
+    def _llm_error(self, e: Exception) -> Exception:
+        """Map an LLM failure to a user-facing (French) error"""
+        error_str = str(e).lower()
+        status = e.status_code if isinstance(e, APIStatusError) else None
+        
+        # Check if it's a quota/rate limit error
+        if status == 429 or (status is None and _is_quota_error(error_str)):
+            logger.error(f"API quota exceeded: {e}")
+            return Exception(
+                "La limite de débit de l'API Cerebras a été dépassée. Veuillez réessayer plus tard ou vérifier les détails de facturation de votre clé API sur "
+                "https://cloud.cerebras.ai"
+            )
+        
+        # Check if it's an authentication error
+        if status in (401, 403) or (status is None and _is_auth_error(error_str)):
+            logger.error(f"API authentication failed: {e}")
+            return Exception(
+                "Clé API invalide ou non autorisée. Veuillez vérifier votre clé API Cerebras dans les Paramètres. "
+                "Obtenez une clé valide depuis https://cloud.cerebras.ai"
+            )
+        
+        logger.error(f"Error in RAG service: {e}")
+        return Exception(f"Échec de génération de réponse: {str(e)}")
+    
+    def _count_tokens(self, text: str) -> int:
+        """Count tokens with tiktoken (or estimate as chars / CHARS_PER_TOKEN)"""
+        if self._enc is not None:
+            return len(self._enc.encode(text, disallowed_special=()))
+        return len(text) // CHARS_PER_TOKEN
+    
+    def _fit_context_budget(self, docs: List[RetrievedDoc]) -> List[RetrievedDoc]:
+        """
+        Keep documents (already in rank order) until max_context_tokens is reached
+        
+        Tokens are counted with a running tiktoken total (chunk text plus its header
+        and separator); the top document is always kept.
+        """
+        # Per-document overhead: header line + separator (sized with a representative header)
+        overhead = self._count_tokens(
+            CONTEXT_SEPARATOR + "[Document 10: document.pdf | Pertinence: 0.00 | Reclass.: 0.00 | Méthode: hybrid]\n"
+        )
+        kept = []
+        used = 0
+        
+        for doc in docs:
+            n = self._count_tokens(doc.text) + overhead
+            if kept and used + n > self.max_context_tokens:
+                break
+            kept.append(doc)
+            used += n
+        
+        if len(kept) < len(docs):
+            logger.info(
+                f"Context budget ({self.max_context_tokens} tokens) reached: "
+                f"kept {len(kept)} documents (~{used} tokens), dropped {len(docs) - len(kept)}"
+            )
+        
+        return kept
     
-    def _build_optimized_context(self, docs: List[str], metadata: List[Dict]) -> str:
+    def _build_optimized_context(self, docs: List[RetrievedDoc]) -> str:
         """Build optimized context from documents with proper formatting"""
         if not docs:
             return "Aucun document pertinent trouvé dans la base de connaissances."
         
-        context_parts = []
-        for i, (doc, meta) in enumerate(zip(docs, metadata), 1):
-            source = meta.get('source', 'Inconnu')
-            relevance = meta.get('relevance_score', 0)
-            reranker_score = meta.get('reranker_score', 0)
-            method = meta.get('retrieval_method', 'N/A')
+        # Write parts straight into one buffer (chunks are already trimmed by the processor)
+        buf = io.StringIO()
+        for i, doc in enumerate(docs, 1):
+            if i > 1:
+                buf.write(CONTEXT_SEPARATOR)
             
             # Format each document chunk with clear separation and enhanced metadata
-            chunk_text = (
-                f"[Document {i}: {source} | "
-                f"Pertinence: {relevance:.2f} | "
-                f"Reclass.: {reranker_score:.2f} | "
-                f"Méthode: {method}]\n"
-                f"{doc.strip()}"
-            )
-            context_parts.append(chunk_text)
+            buf.write("[Document ")
+            buf.write(str(i))
+            buf.write(": ")
+            buf.write(doc.source if doc.source != 'Unknown' else 'Inconnu')
+            buf.write(f" | Pertinence: {doc.relevance:.2f} | Reclass.: {doc.reranker_score:.2f} | Méthode: ")
+            buf.write(doc.retrieval_method)
+            buf.write("]\n")
+            buf.write(doc.text)
         
-        # Join with clear separators
-        return "\n\n" + "="*80 + "\n\n".join(context_parts)
+        return buf.getvalue()
     
     def _build_system_prompt(self, context: str, query: str = "", is_non_french_query: bool = False) -> str:
         """Build an enhanced system prompt for better RAG accuracy - ALWAYS RESPOND IN FRENCH"""
-        french_instruction = ""
-        if is_non_french_query:
-            french_instruction = "\n\n**LANGUE DE RÉPONSE OBLIGATOIRE**: Vous DEVEZ répondre UNIQUEMENT en français, quelle que soit la langue de la question. C'est une exigence absolue du système.\n"
-        
-        return f"""Vous êtes un assistant IA expert spécialisé dans la réponse aux questions basées sur le contexte documentaire fourni.
-
-PRINCIPES FONDAMENTAUX:
-1. **ADHÉRENCE STRICTE AU CONTEXTE**: Répondez UNIQUEMENT en utilisant les informations des documents fournis ci-dessous
-2. **PRÉCISION AVANT TOUT**: Si le contexte manque d'informations pertinentes, indiquez explicitement : "Je n'ai pas d'information à ce sujet dans les documents indexés."
-3. **PAS D'HALLUCINATION**: N'inventez jamais, ne supposez jamais et n'utilisez jamais de connaissances externes non présentes dans le contexte
-4. **ATTRIBUTION DES SOURCES**: Référencez les documents spécifiques lors de la fourniture d'informations
-5. **RÉPONSE EN FRANÇAIS UNIQUEMENT**: Vous devez TOUJOURS répondre en français, quelle que soit la langue de la question posée
-6. **CLARTÉ**: Fournissez des réponses claires, concises et bien structurées en français
-7. **ORIENTÉ VERS LES DÉTAILS**: Portez une attention particulière aux détails subtils, aux chiffres spécifiques, aux noms et aux dates dans les documents{french_instruction}
-CONTEXTE DOCUMENTAIRE INDEXÉ:
-{context}
-
-DIRECTIVES DE RÉPONSE:
-- Extrayez et synthétisez les informations pertinentes des documents
-- Citez les sources documentaires lors de votre réponse (par ex., "Selon [Nom du Document]...")
-- Si plusieurs documents contiennent des informations pertinentes, intégrez-les de manière cohérente
-- Pour les questions sur des détails spécifiques (chiffres, noms, dates), soyez extrêmement précis
-- Si la question contient des variations orthographiques ou des synonymes, comprenez l'intention
-- Pour les questions peu claires ou ambiguës, fournissez les informations les plus pertinentes disponibles
-- Maintenez un ton professionnel et utile
-- **IMPORTANT**: Répondez TOUJOURS en français, même si la question est dans une autre langue
-
-Répondez maintenant à la question de l'utilisateur en vous basant uniquement sur le contexte ci-dessus, EN FRANÇAIS."""
+        return "".join((
+            SYSTEM_PREAMBLE,
+            FRENCH_INSTRUCTION if is_non_french_query else "",
+            CONTEXT_HEADER,
+            context,
+            SYSTEM_EPILOGUE
+        ))
     
     def _handle_no_documents_found(self, query: str) -> str:
         """Handle case when no documents are found - FRENCH RESPONSE"""
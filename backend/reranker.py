@@ -1,10 +1,30 @@
 import logging
+from functools import lru_cache
 from typing import List, Dict, Tuple
 from sentence_transformers import CrossEncoder
 import numpy as np
+import torch
+from cache_manager import ScoreCache, content_hash
 
 logger = logging.getLogger(__name__)
 
+# Default character cap applied to documents before tokenization (~4 chars per token x 512 tokens)
+MAX_DOC_CHARS = 2048
+
+
+@lru_cache(maxsize=4)
+def load_cross_encoder(model_name: str, max_length: int = 512) -> CrossEncoder:
+    """Load a cross-encoder once per process; rerankers built for the same model share it"""
+    return CrossEncoder(model_name, max_length=max_length)
+
+
+def cpu_supports_bf16() -> bool:
+    """True when the CPU has native BF16 matmul (AVX-512 BF16 / AMX); autocast only pays off there"""
+    try:
+        return bool(torch.ops.mkldnn._is_mkldnn_bf16_supported())
+    except Exception:
+        return False
+
 
 class Reranker:
     """Cross-encoder reranker for improving retrieval accuracy"""
@@ -20,18 +40,28 @@ class Reranker:
         """
         logger.info(f"Loading cross-encoder model: {model_name}")
         try:
-            self.model = CrossEncoder(model_name, max_length=512)
+            self.model = load_cross_encoder(model_name, max_length=512)
             logger.info(f"Reranker model loaded successfully")
         except Exception as e:
             logger.error(f"Failed to load reranker model: {e}")
             self.model = None
+        
+        # Documents are clipped before tokenization so outlier chunks don't inflate tokenizer time
+        self.max_doc_chars = MAX_DOC_CHARS
+        
+        # BF16 autocast for the forward pass on CPUs with native BF16 support
+        self.use_bf16 = cpu_supports_bf16()
+        
+        # Scores are deterministic per (query, document), so repeated queries skip the model
+        self._score_cache = ScoreCache(max_size=50_000)
     
     def rerank(
         self,
         query: str,
         documents: List[str],
         metadata: List[Dict],
-        top_k: int = 8
+        top_k: int = 8,
+        copy_metadata: bool = False
     ) -> Tuple[List[str], List[Dict]]:
         """
         Rerank documents using cross-encoder for better relevance
@@ -41,6 +71,35 @@ class Reranker:
             documents: List of retrieved documents
             metadata: List of metadata dicts for each document
             top_k: Number of top results to return
+            copy_metadata: Return copies instead of annotating the caller's metadata dicts in place
+        
+        Returns:
+            Reranked documents and metadata
+        """
+        return self.rerank_multi_query([query], documents, metadata, top_k=top_k, copy_metadata=copy_metadata)
+    
+    def rerank_multi_query(
+        self,
+        queries: List[str],
+        documents: List[str],
+        metadata: List[Dict],
+        top_k: int = 8,
+        enable_exact_match_boost: bool = False,
+        copy_metadata: bool = False
+    ) -> Tuple[List[str], List[Dict]]:
+        """
+        Rerank documents against several query variations in one batch
+        
+        Every (query, doc) pair is scored in a single forward pass and each document keeps
+        its best score, so a chunk matching any variation well ranks high.
+        
+        Args:
+            queries: Query variations (the corrected query first)
+            documents: List of retrieved documents
+            metadata: List of metadata dicts for each document
+            top_k: Number of top results to return
+            enable_exact_match_boost: Accepted for interface parity with RerankerOptimized (no boosting here)
+            copy_metadata: Return copies instead of annotating the caller's metadata dicts in place
         
         Returns:
             Reranked documents and metadata
@@ -53,18 +112,20 @@ class Reranker:
             return [], []
         
         try:
-            # Prepare query-document pairs
-            pairs = [[query, doc] for doc in documents]
+            # Get relevance scores from cross-encoder (documents clipped before tokenization)
+            # and keep each document's best score across the query variations
+            scores = self._cached_score_matrix(queries, [doc[:self.max_doc_chars] for doc in documents]).max(axis=0)
             
-            # Get relevance scores from cross-encoder
-            scores = self.model.predict(pairs)
-            
-            # Sort by scores (descending)
-            sorted_indices = np.argsort(scores)[::-1]
+            # Select the top_k scores, then sort only those (descending)
+            k = min(top_k, len(scores))
+            top = np.argpartition(-scores, k - 1)[:k]
+            sorted_indices = top[np.argsort(-scores[top], kind='stable')]
             
             # Rerank documents and metadata
             reranked_docs = [documents[idx] for idx in sorted_indices[:top_k]]
-            reranked_metadata = [metadata[idx].copy() for idx in sorted_indices[:top_k]]
+            reranked_metadata = [metadata[idx] for idx in sorted_indices[:top_k]]
+            if copy_metadata:
+                reranked_metadata = [meta.copy() for meta in reranked_metadata]
             
             # Add reranker scores to metadata
             for i, idx in enumerate(sorted_indices[:top_k]):
@@ -72,8 +133,11 @@ class Reranker:
                 reranked_metadata[i]['original_rank'] = int(idx + 1)
                 reranked_metadata[i]['reranked_position'] = i + 1
             
-            logger.info(f"Reranked {len(documents)} documents -> top {len(reranked_docs)} results")
-            logger.debug(f"Top reranker score: {scores[sorted_indices[0]]:.3f}, Lowest: {scores[sorted_indices[top_k-1]]:.3f}")
+            logger.info(f"Reranked {len(documents)} documents against {len(queries)} queries -> top {len(reranked_docs)} results")
+            logger.debug(
+                "Top reranker score: %.3f, Lowest: %.3f",
+                scores[sorted_indices[0]], scores[sorted_indices[len(reranked_docs) - 1]]
+            )
             
             return reranked_docs, reranked_metadata
         
@@ -82,6 +146,60 @@ class Reranker:
             # Fallback to original order
             return documents[:top_k], metadata[:top_k]
     
+    def _cached_score_matrix(self, queries: List[str], documents: List[str]) -> np.ndarray:
+        """
+        Cross-encoder scores of shape (len(queries), len(documents))
+        
+        The model only runs on (query, doc) pairs not scored before, all in one batch.
+        """
+        doc_keys = [content_hash(doc) for doc in documents]
+        return self._score_cache.score_matrix(
+            queries,
+            doc_keys,
+            lambda rows, cols: self._predict_scores([queries[r] for r in rows], [documents[c] for c in cols])
+        )
+    
+    def _predict_scores(self, queries: List[str], documents: List[str]) -> np.ndarray:
+        """Score the (queries[i], documents[i]) pairs with one tokenizer call and one forward pass"""
+        try:
+            features = self.model.tokenizer(
+                queries,
+                documents,
+                padding=True,
+                truncation='longest_first',
+                max_length=self.model.max_length,
+                return_tensors='pt'
+            )
+            
+            hf_model = self.model.model
+            device = next(hf_model.parameters()).device
+            features = {name: tensor.to(device) for name, tensor in features.items()}
+            
+            activation = (
+                getattr(self.model, 'activation_fn', None)
+                or getattr(self.model, 'default_activation_function', None)
+                or torch.nn.Identity()
+            )
+            
+            hf_model.eval()
+            with torch.inference_mode(), torch.autocast(
+                device_type='cpu', dtype=torch.bfloat16, enabled=self.use_bf16 and device.type == 'cpu'
+            ):
+                # Upcast logits to FP32 before the activation and sorting
+                logits = activation(hf_model(**features, return_dict=True).logits.float())
+            
+            scores = logits.float().cpu().numpy()
+            return scores[:, 0] if scores.ndim == 2 and scores.shape[1] == 1 else scores
+        
+        except Exception as e:
+            logger.debug("Direct scoring unavailable, using CrossEncoder.predict: %s", e)
+            return self.model.predict(
+                list(zip(queries, documents)),
+                batch_size=64,
+                show_progress_bar=False,
+                convert_to_numpy=True
+            )
+    
     def compute_dynamic_threshold(self, scores: List[float], percentile: float = 50) -> float:
         """
         Compute dynamic relevance threshold based on score distribution
@@ -93,11 +211,11 @@ class Reranker:
         Returns:
             Dynamic threshold value
         """
-        if not scores:
+        if len(scores) == 0:
             return 0.3  # Default fallback
         
         threshold = np.percentile(scores, percentile)
-        logger.debug(f"Dynamic threshold at {percentile}th percentile: {threshold:.3f}")
+        logger.debug("Dynamic threshold at %sth percentile: %.3f", percentile, threshold)
         
         return float(threshold)
     
@@ -1,43 +1,71 @@
+import copy
 import logging
+import os
+from collections import OrderedDict
 from typing import List, Dict, Tuple, Optional
-from sentence_transformers import CrossEncoder
 import numpy as np
+import torch
+import config_paths
+from cache_manager import ScoreCache, content_hash
 from entity_extractor import EntityExtractor
+from reranker import cpu_supports_bf16, load_cross_encoder
 
 logger = logging.getLogger(__name__)
 
+# Quantized ONNX exports of reranker models
+ONNX_CACHE_DIR = config_paths.CACHE_DIR / "onnx"
+
+# Default character cap applied to documents before tokenization (~4 chars per token x 512 tokens)
+MAX_DOC_CHARS = 2048
+
+# Pair-length bucket boundaries (tokens) for padding; longer pairs share a final bucket
+LENGTH_BUCKETS = np.array([128, 256, 384])
+
+# Use every core for CPU inference
+torch.set_num_threads(os.cpu_count() or 1)
+
 
 class RerankerOptimized:
     """
-    OPTIMIZED cross-encoder reranker with French CamemBERT model and exact match boosting
+    OPTIMIZED cross-encoder reranker with multilingual BGE model and exact match boosting
     
     Key improvements:
-    - CamemBERT model for French-optimized reranking
+    - bge-reranker-v2-m3 cross-encoder for French-capable reranking (sigmoid relevance scores)
     - Exact match detection for names and data (boosted scores)
     - Entity overlap scoring
     - Adjusted thresholds for better precision
     """
     
-    def __init__(self, model_name: str = 'cross-encoder/ms-marco-MiniLM-L-6-v2'):
+    def __init__(
+        self,
+        model_name: str = 'BAAI/bge-reranker-v2-m3',
+        max_length: int = 256,
+        use_onnx: Optional[bool] = None
+    ):
         """
-        Initialize optimized reranker - MEMORY OPTIMIZED
+        Initialize optimized reranker
         
-        Default: cross-encoder/ms-marco-MiniLM-L-6-v2 (lightweight, 90MB)
-        Optional: dangvantuan/sentence-camembert-large (French, but 1.3GB - heavy)
+        Default: BAAI/bge-reranker-v2-m3 (multilingual cross-encoder with good French, ~570M params)
+        Fallback: cross-encoder/ms-marco-MiniLM-L-6-v2 (lightweight, 90MB, English-centric)
         
-        Using lightweight model by default to prevent memory issues
+        max_length: Pair length in tokens (256 keeps chunk-sized pairs while bounding latency)
+        use_onnx: Run inference with an int8 dynamically quantized ONNX export
+        (defaults to the RERANKER_ONNX environment variable, or to an existing export when unset;
+        falls back to FP32 PyTorch)
         """
-        logger.info(f"Loading cross-encoder model: {model_name}")
+        logger.info(f"Loading cross-encoder model: {model_name} (max_length={max_length})")
         try:
-            self.model = CrossEncoder(model_name, max_length=512)
+            self.model = load_cross_encoder(model_name, max_length=max_length)
             self.model_name = model_name
             logger.info(f"Reranker model loaded successfully: {model_name}")
         except Exception as e:
             logger.error(f"Failed to load reranker model {model_name}: {e}")
-            logger.warning("Falling back to ms-marco-MiniLM...")
+            logger.warning(
+                "Falling back to ms-marco-MiniLM: much lighter, but English-trained and less precise on French documents"
+            )
             try:
                 # Fallback to lightweight ms-marco
-                self.model = CrossEncoder('cross-encoder/ms-marco-MiniLM-L-6-v2', max_length=512)
+                self.model = load_cross_encoder('cross-encoder/ms-marco-MiniLM-L-6-v2', max_length=max_length)
                 self.model_name = 'cross-encoder/ms-marco-MiniLM-L-6-v2'
                 logger.info("Fallback model loaded: ms-marco-MiniLM-L-6-v2")
             except Exception as e2:
@@ -45,6 +73,29 @@ class RerankerOptimized:
                 self.model = None
                 self.model_name = None
         
+        # Optional int8 ONNX Runtime session (the CrossEncoder is still used for tokenization)
+        if use_onnx is None:
+            env_flag = os.environ.get('RERANKER_ONNX')
+            if env_flag is not None:
+                use_onnx = env_flag.lower() in ('1', 'true', 'yes')
+            else:
+                # Reuse a previous export automatically; exporting only happens when explicitly requested
+                use_onnx = self.model_name is not None and self._onnx_model_file(self.model_name).exists()
+        self._onnx_session = self._load_onnx_session(self.model_name) if use_onnx and self.model else None
+        
+        # BF16 autocast for the PyTorch path on CPUs with native BF16 support
+        self.use_bf16 = cpu_supports_bf16()
+        
+        # Documents are clipped before tokenization so outlier chunks don't inflate tokenizer time
+        self.max_doc_chars = MAX_DOC_CHARS
+        
+        # Document-side encodings keyed by xxhash of the text (they don't depend on the query)
+        self._tok_cache = OrderedDict()
+        self._tok_cache_size = 4096
+        
+        # Scores are deterministic per (query, document), so repeated queries skip the model
+        self._score_cache = ScoreCache(max_size=50_000)
+        
         # Initialize entity extractor for exact match detection
         self.entity_extractor = EntityExtractor()
         
@@ -56,10 +107,11 @@ class RerankerOptimized:
         documents: List[str],
         metadata: List[Dict],
         top_k: int = 8,
-        enable_exact_match_boost: bool = True
+        enable_exact_match_boost: bool = True,
+        copy_metadata: bool = False
     ) -> Tuple[List[str], List[Dict]]:
         """
-        Rerank documents using CamemBERT + exact match boosting
+        Rerank documents with the cross-encoder (bge-reranker-v2-m3) + exact match boosting
         
         Args:
             query: User query
@@ -67,6 +119,42 @@ class RerankerOptimized:
             metadata: List of metadata dicts for each document
             top_k: Number of top results to return
             enable_exact_match_boost: Apply boost for exact entity matches
+            copy_metadata: Return copies instead of annotating the caller's metadata dicts in place
+        
+        Returns:
+            Reranked documents and metadata
+        """
+        return self.rerank_multi_query(
+            [query],
+            documents,
+            metadata,
+            top_k=top_k,
+            enable_exact_match_boost=enable_exact_match_boost,
+            copy_metadata=copy_metadata
+        )
+    
+    def rerank_multi_query(
+        self,
+        queries: List[str],
+        documents: List[str],
+        metadata: List[Dict],
+        top_k: int = 8,
+        enable_exact_match_boost: bool = True,
+        copy_metadata: bool = False
+    ) -> Tuple[List[str], List[Dict]]:
+        """
+        Rerank documents against several query variations in one batch
+        
+        Every (query, doc) pair is scored in the same length-bucketed forward passes and
+        each document keeps its best cross-encoder score; exact match boosts use the first query.
+        
+        Args:
+            queries: Query variations (the corrected query first)
+            documents: List of retrieved documents
+            metadata: List of metadata dicts for each document
+            top_k: Number of top results to return
+            enable_exact_match_boost: Apply boost for exact entity matches
+            copy_metadata: Return copies instead of annotating the caller's metadata dicts in place
         
         Returns:
             Reranked documents and metadata
@@ -79,58 +167,46 @@ class RerankerOptimized:
             return [], []
         
         try:
-            # Step 1: Get CamemBERT scores
-            pairs = [[query, doc] for doc in documents]
-            camembert_scores = self.model.predict(pairs)
+            # Step 1: Get cross-encoder scores (best score across the query variations)
+            cross_encoder_scores = self._cached_score_matrix(queries, documents).max(axis=0)
             
             # Step 2: Compute exact match boosts (if enabled)
-            final_scores = np.array(camembert_scores, dtype=float)
+            final_scores = np.array(cross_encoder_scores, dtype=float)
             
             if enable_exact_match_boost:
-                for i, doc in enumerate(documents):
-                    # Compute entity overlap
-                    entity_overlap = self.entity_extractor.compute_entity_overlap(query, doc)
-                    
-                    # Find exact matches
-                    exact_matches = self.entity_extractor.find_exact_matches(query, doc)
-                    
-                    # Calculate boost
-                    boost = 0.0
-                    
-                    # Boost for entity overlap (0-2 points)
-                    if entity_overlap > 0:
-                        boost += entity_overlap * 2.0
-                        logger.debug(f"Doc {i}: Entity overlap {entity_overlap:.2f} -> +{entity_overlap * 2.0:.2f}")
-                    
-                    # Boost for exact matches (0.5 points per match, max 3)
-                    if exact_matches:
-                        match_boost = min(len(exact_matches) * 0.5, 3.0)
-                        boost += match_boost
-                        logger.debug(f"Doc {i}: {len(exact_matches)} exact matches -> +{match_boost:.2f}")
-                    
-                    # Apply boost
-                    if boost > 0:
-                        final_scores[i] += boost
-                        logger.info(f"Doc {i}: CamemBERT={camembert_scores[i]:.2f}, Boost={boost:.2f}, Final={final_scores[i]:.2f}")
+                boosts = self._exact_match_boosts(queries[0], documents)
+                if boosts is not None:
+                    final_scores += boosts
+                    logger.info(
+                        f"Exact match boost applied to {np.count_nonzero(boosts)}/{len(documents)} docs "
+                        f"(max +{boosts.max():.2f})"
+                    )
             
-            # Step 3: Sort by final scores
-            sorted_indices = np.argsort(final_scores)[::-1]
+            # Step 3: Select the top_k final scores, then sort only those
+            k = min(top_k, len(final_scores))
+            top = np.argpartition(-final_scores, k - 1)[:k]
+            sorted_indices = top[np.argsort(-final_scores[top], kind='stable')]
             
             # Step 4: Prepare reranked results
             reranked_docs = [documents[idx] for idx in sorted_indices[:top_k]]
-            reranked_metadata = [metadata[idx].copy() for idx in sorted_indices[:top_k]]
+            reranked_metadata = [metadata[idx] for idx in sorted_indices[:top_k]]
+            if copy_metadata:
+                reranked_metadata = [meta.copy() for meta in reranked_metadata]
             
             # Step 5: Add scoring metadata
             for i, idx in enumerate(sorted_indices[:top_k]):
                 reranked_metadata[i]['reranker_score'] = float(final_scores[idx])
-                reranked_metadata[i]['camembert_score'] = float(camembert_scores[idx])
+                reranked_metadata[i]['cross_encoder_score'] = float(cross_encoder_scores[idx])
                 reranked_metadata[i]['original_rank'] = int(idx + 1)
                 reranked_metadata[i]['reranked_position'] = i + 1
                 reranked_metadata[i]['reranker_model'] = self.model_name
             
-            logger.info(f"Reranked {len(documents)} docs with CamemBERT + exact match -> top {len(reranked_docs)} results")
+            logger.info(
+                f"Reranked {len(documents)} docs against {len(queries)} queries with {self.model_name} + exact match "
+                f"-> top {len(reranked_docs)} results"
+            )
             if reranked_docs:
-                logger.info(f"Score range: {final_scores[sorted_indices[0]]:.2f} (top) to {final_scores[sorted_indices[top_k-1]]:.2f} (bottom)")
+                logger.info(f"Score range: {final_scores[sorted_indices[0]]:.2f} (top) to {final_scores[sorted_indices[len(reranked_docs)-1]]:.2f} (bottom)")
             
             return reranked_docs, reranked_metadata
         
@@ -139,6 +215,211 @@ class RerankerOptimized:
             # Fallback to original order
             return documents[:top_k], metadata[:top_k]
     
+    def _exact_match_boosts(self, query: str, documents: List[str]) -> Optional[np.ndarray]:
+        """
+        Entity boosts for all documents at once (None when the query has no entities)
+        
+        Query entities are extracted once; each document then only needs substring checks.
+        Boost = entity overlap ratio * 2.0 + 0.5 per exact match (max 3.0)
+        """
+        query_entities = self.entity_extractor.extract_entities(query)
+        query_terms = [entity.lower() for entity_list in query_entities.values() for entity in entity_list]
+        if not query_terms:
+            return None
+        
+        matches = np.fromiter(
+            (sum(term in doc_lower for term in query_terms) for doc_lower in map(str.lower, documents)),
+            dtype=float,
+            count=len(documents)
+        )
+        return matches * (2.0 / len(query_terms)) + np.minimum(matches * 0.5, 3.0)
+    
+    @staticmethod
+    def _onnx_model_file(model_name: str):
+        """Path of the int8 ONNX export for a model"""
+        return ONNX_CACHE_DIR / model_name.replace('/', '__') / 'model_quantized.onnx'
+    
+    def _load_onnx_session(self, model_name: str):
+        """
+        Load (exporting and quantizing on first use) an int8 ONNX version of the reranker
+        
+        The quantized model is saved under .cache/onnx so the export only happens once.
+        Returns None (FP32 PyTorch inference) if optimum/onnxruntime are unavailable or export fails.
+        """
+        model_file = self._onnx_model_file(model_name)
+        model_dir = model_file.parent
+        
+        try:
+            if not model_file.exists():
+                from optimum.onnxruntime import ORTModelForSequenceClassification, ORTQuantizer
+                from optimum.onnxruntime.configuration import AutoQuantizationConfig
+                
+                logger.info(f"Exporting {model_name} to ONNX with int8 dynamic quantization (one-time)...")
+                ort_model = ORTModelForSequenceClassification.from_pretrained(model_name, export=True)
+                ort_model.save_pretrained(model_dir / 'fp32')
+                
+                quantizer = ORTQuantizer.from_pretrained(ort_model)
+                quantizer.quantize(
+                    save_dir=model_dir,
+                    quantization_config=AutoQuantizationConfig.avx2(is_static=False, per_channel=False)
+                )
+            
+            import onnxruntime as ort
+            sess_options = ort.SessionOptions()
+            sess_options.intra_op_num_threads = os.cpu_count() or 1
+            session = ort.InferenceSession(str(model_file), sess_options=sess_options, providers=['CPUExecutionProvider'])
+            
+            logger.info(f"Reranker using int8 ONNX Runtime model: {model_file}")
+            return session
+        
+        except Exception as e:
+            logger.warning(f"Could not load ONNX reranker ({e}), using FP32 PyTorch inference")
+            return None
+    
+    def _doc_encodings(self, documents: List[str]) -> list:
+        """Get document-side encodings (no special tokens), tokenizing only cache misses in one batch"""
+        keys = [content_hash(doc) for doc in documents]
+        
+        missed = {}
+        for key, doc in zip(keys, documents):
+            if key not in self._tok_cache:
+                missed[key] = doc[:self.max_doc_chars].strip()
+        
+        if missed:
+            encoded = self.model.tokenizer.backend_tokenizer.encode_batch(
+                list(missed.values()),
+                add_special_tokens=False
+            )
+            for key, encoding in zip(missed, encoded):
+                if len(self._tok_cache) >= self._tok_cache_size:
+                    self._tok_cache.popitem(last=False)
+                self._tok_cache[key] = encoding
+        
+        encodings = []
+        for key in keys:
+            self._tok_cache.move_to_end(key)
+            encodings.append(self._tok_cache[key])
+        
+        return encodings
+    
+    def _cached_score_matrix(self, queries: List[str], documents: List[str]) -> np.ndarray:
+        """
+        Cross-encoder scores of shape (len(queries), len(documents))
+        
+        The model only runs on (query, doc) pairs not scored before, all in one batch.
+        """
+        doc_keys = [content_hash(doc) for doc in documents]
+        return self._score_cache.score_matrix(
+            queries,
+            doc_keys,
+            lambda rows, cols: self._predict_scores([queries[r] for r in rows], [documents[c] for c in cols])
+        )
+    
+    def _predict_scores(self, queries: List[str], documents: List[str]) -> np.ndarray:
+        """
+        Cross-encoder scores for the (queries[i], documents[i]) pairs, reusing cached document encodings
+        
+        Only the distinct queries are tokenized per call; each pair is assembled by the tokenizer's
+        post-processor (special tokens, token types) with the document side truncated to
+        fit max_length, then scored in length-bucketed forward passes.
+        Falls back to CrossEncoder.predict if the tokenizer has no fast backend.
+        """
+        try:
+            backend = self.model.tokenizer.backend_tokenizer
+            max_length = self.model.max_length
+            num_special = backend.num_special_tokens_to_add(True)
+            
+            # (encoding, document token budget) per distinct query
+            query_encodings = {}
+            for query in dict.fromkeys(queries):
+                query_encoding = backend.encode(query.strip(), add_special_tokens=False)
+                if len(query_encoding) > max_length // 2:
+                    query_encoding.truncate(max_length // 2)
+                query_encodings[query] = (query_encoding, max(max_length - len(query_encoding) - num_special, 1))
+            
+            pairs = []
+            for query, doc_encoding in zip(queries, self._doc_encodings(documents)):
+                query_encoding, doc_budget = query_encodings[query]
+                if len(doc_encoding) > doc_budget:
+                    # Truncate a copy, the cached encoding is reused by later queries
+                    doc_encoding = copy.deepcopy(doc_encoding)
+                    doc_encoding.truncate(doc_budget)
+                pairs.append(backend.post_process(query_encoding, doc_encoding, add_special_tokens=True))
+            
+            # Sort pairs by length and forward them in length buckets, so short pairs
+            # are not padded out to the longest candidate; scores are scattered back in order
+            lengths = np.fromiter((len(pair.ids) for pair in pairs), dtype=np.int64, count=len(pairs))
+            order = np.argsort(lengths, kind='stable')
+            bucket_ids = np.searchsorted(LENGTH_BUCKETS, lengths[order], side='left')
+            
+            scores = None
+            for bucket in np.unique(bucket_ids):
+                indices = order[bucket_ids == bucket]
+                bucket_scores = self._forward([pairs[i] for i in indices])
+                if scores is None:
+                    scores = np.empty((len(pairs),) + bucket_scores.shape[1:], dtype=bucket_scores.dtype)
+                scores[indices] = bucket_scores
+            
+            return scores[:, 0] if scores.ndim == 2 and scores.shape[1] == 1 else scores
+        
+        except Exception as e:
+            logger.debug("Cached-token scoring unavailable, using CrossEncoder.predict: %s", e)
+            return self.model.predict(
+                list(zip(queries, [doc[:self.max_doc_chars] for doc in documents])),
+                batch_size=64,
+                show_progress_bar=False,
+                convert_to_numpy=True
+            )
+    
+    def _forward(self, pairs: list) -> np.ndarray:
+        """Pad a list of encoded pairs into one batch and return activated logits"""
+        width = max(len(pair.ids) for pair in pairs)
+        pad_id = self.model.tokenizer.pad_token_id or 0
+        input_ids = np.full((len(pairs), width), pad_id, dtype=np.int64)
+        token_type_ids = np.zeros((len(pairs), width), dtype=np.int64)
+        attention_mask = np.zeros((len(pairs), width), dtype=np.int64)
+        for i, pair in enumerate(pairs):
+            n = len(pair.ids)
+            input_ids[i, :n] = pair.ids
+            token_type_ids[i, :n] = pair.type_ids
+            attention_mask[i, :n] = 1
+        
+        activation = (
+            getattr(self.model, 'activation_fn', None)
+            or getattr(self.model, 'default_activation_function', None)
+            or torch.nn.Identity()
+        )
+        
+        if self._onnx_session is not None:
+            # int8 ONNX Runtime path
+            inputs = {
+                'input_ids': input_ids,
+                'attention_mask': attention_mask,
+                'token_type_ids': token_type_ids
+            }
+            feed = {inp.name: inputs[inp.name] for inp in self._onnx_session.get_inputs()}
+            logits = torch.from_numpy(self._onnx_session.run(None, feed)[0])
+            with torch.inference_mode():
+                logits = activation(logits)
+        else:
+            hf_model = self.model.model
+            device = next(hf_model.parameters()).device
+            batch = {
+                'input_ids': torch.from_numpy(input_ids).to(device),
+                'attention_mask': torch.from_numpy(attention_mask).to(device)
+            }
+            if 'token_type_ids' in self.model.tokenizer.model_input_names:
+                batch['token_type_ids'] = torch.from_numpy(token_type_ids).to(device)
+            
+            hf_model.eval()
+            with torch.inference_mode(), torch.autocast(
+                device_type='cpu', dtype=torch.bfloat16, enabled=self.use_bf16 and device.type == 'cpu'
+            ):
+                # Upcast logits to FP32 before the activation and sorting
+                logits = activation(hf_model(**batch, return_dict=True).logits.float())
+        
+        return logits.float().cpu().numpy()
+    
     def compute_dynamic_threshold(self, scores: List[float], percentile: float = 20) -> float:
         """
         Compute dynamic relevance threshold - OPTIMIZED for precision
@@ -150,11 +431,11 @@ class RerankerOptimized:
         Returns:
             Dynamic threshold value
         """
-        if not scores:
+        if len(scores) == 0:
             return 0.5  # Higher default for precision
         
         threshold = np.percentile(scores, percentile)
-        logger.debug(f"Dynamic threshold at {percentile}th percentile: {threshold:.3f}")
+        logger.debug("Dynamic threshold at %sth percentile: %.3f", percentile, threshold)
         
         return float(threshold)
     
@@ -180,25 +461,25 @@ class RerankerOptimized:
         if not documents:
             return [], []
         
-        # Extract scores
-        scores = [meta.get('reranker_score', 0.0) for meta in metadata]
-        
+        # Extract scores into a contiguous array
+        scores = np.fromiter(
+            (meta.get('reranker_score', 0.0) for meta in metadata),
+            dtype=float,
+            count=len(metadata)
+        )
+
         # Determine threshold
-        if use_dynamic_threshold and scores:
+        if use_dynamic_threshold and scores.size:
             # Use 20th percentile for stricter filtering
             threshold = self.compute_dynamic_threshold(scores, percentile=20)
             logger.info(f"Using dynamic threshold: {threshold:.3f}")
         else:
             threshold = min_score
-        
-        # Filter
-        filtered_docs = []
-        filtered_meta = []
-        
-        for doc, meta, score in zip(documents, metadata, scores):
-            if score >= threshold:
-                filtered_docs.append(doc)
-                filtered_meta.append(meta)
+
+        # Filter with a single vectorized mask
+        keep = np.flatnonzero(scores >= threshold)
+        filtered_docs = [documents[i] for i in keep]
+        filtered_meta = [metadata[i] for i in keep]
         
         logger.info(f"Filtered {len(documents)} documents by threshold={threshold:.3f} -> {len(filtered_docs)} kept")
         
@@ -2,11 +2,17 @@
 import config_paths
 
 from fastapi import FastAPI, APIRouter, HTTPException, BackgroundTasks
+from fastapi.responses import StreamingResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import AsyncMongoClient
 import os
+import json
 import logging
+import logging.handlers
+import queue
+import sys
+import time
 from pathlib import Path
 from pydantic import BaseModel, Field, ConfigDict
 from typing import List, Optional, Dict
@@ -14,16 +20,17 @@ import uuid
 from datetime import datetime, timezone
 import asyncio
 from watchdog.observers import Observer
-from watchdog.events import FileSystemEventHandler
+from watchdog.events import PatternMatchingEventHandler
 
 # Import document processing and RAG services
 from document_processor import DocumentProcessor
-from document_processor_optimized import OptimizedDocumentProcessor
+from document_processor_optimized import init_worker, process_document_in_worker
 from vector_store import VectorStoreService
 from vector_store_optimized import OptimizedVectorStoreService
 from document_cache import DocumentCache
 from rag_service import RAGService
-from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 import multiprocessing
 
 ROOT_DIR = Path(__file__).parent
@@ -31,7 +38,16 @@ load_dotenv(ROOT_DIR / '.env')
 
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+# Native asyncio driver; a few connections are opened up front so the first requests don't pay for them
+# tz_aware: BSON dates (chat/settings timestamps) come back as UTC-aware datetimes
+client = AsyncMongoClient(
+    mongo_url,
+    maxPoolSize=50,
+    minPoolSize=10,
+    maxIdleTimeMS=60000,
+    serverSelectionTimeoutMS=5000,
+    tz_aware=True
+)
 db = client[os.environ['DB_NAME']]
 
 # Create the main app without a prefix
@@ -41,13 +57,91 @@ app = FastAPI()
 api_router = APIRouter(prefix="/api")
 
 # Initialize services with RAG-enhanced versions
-doc_processor = OptimizedDocumentProcessor()  # Use optimized processor
 vector_service = VectorStoreService()  # Use RAG-enhanced vector store with hybrid search
 document_cache = DocumentCache(db)  # Initialize cache
 rag_service = RAGService(vector_service, db)
 
-# Process pool for parallel document processing
+# Process pool for parallel document processing (created once, reused by every reindex)
 process_pool = None
+PARSE_WORKERS = max(1, multiprocessing.cpu_count() - 1)
+
+# Files parsed but not yet handed to the insert queue are capped, so parsed chunks
+# cannot pile up in memory while vector inserts are behind
+MAX_INFLIGHT_PARSES = 2 * PARSE_WORKERS
+
+def get_process_pool() -> ProcessPoolExecutor:
+    """Return the shared document processing pool, creating it on first use
+    
+    Uses the forkserver start method where available so workers are spawned from a
+    small, clean server process instead of forking the whole API process.
+    """
+    global process_pool
+    if process_pool is None:
+        mp_context = (
+            multiprocessing.get_context("forkserver")
+            if "forkserver" in multiprocessing.get_all_start_methods()
+            else None
+        )
+        process_pool = ProcessPoolExecutor(
+            max_workers=PARSE_WORKERS,
+            mp_context=mp_context,
+            initializer=init_worker
+        )
+    return process_pool
+
+def discard_process_pool(broken: ProcessPoolExecutor):
+    """Drop a pool whose worker died (e.g. OOM on a huge PDF) so the next get_process_pool() starts a fresh one
+    
+    Tasks that hit the same broken pool all call this; only the first one shuts it down.
+    """
+    global process_pool
+    if process_pool is broken:
+        process_pool = None
+        broken.shutdown(wait=False, cancel_futures=True)
+
+# Plain-text formats are cheap to parse and mostly I/O: handled on threads, no IPC round-trip
+IO_BOUND_EXTENSIONS = frozenset({'.txt', '.md', '.json', '.csv'})
+io_thread_pool = None
+
+def get_io_thread_pool() -> ThreadPoolExecutor:
+    """Return the shared thread pool for I/O-bound document formats, creating it on first use"""
+    global io_thread_pool
+    if io_thread_pool is None:
+        io_thread_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="doc-io")
+    return io_thread_pool
+
+# File categories for the documents list
+DOCUMENT_CATEGORIES = {
+    "PDF": ['.pdf'],
+    "Word": ['.docx', '.doc'],
+    "Excel": ['.xlsx', '.xls'],
+    "Text": ['.txt', '.md'],
+    "Data": ['.json', '.csv'],
+    "OpenDocument": ['.odt']
+}
+EXTENSION_CATEGORY = {ext: category for category, extensions in DOCUMENT_CATEGORIES.items() for ext in extensions}
+
+SUPPORTED_EXTENSIONS = frozenset(EXTENSION_CATEGORY)
+
+def _iter_supported(root: str):
+    """Recursively yield os.DirEntry objects for supported documents, skipping hidden directories"""
+    with os.scandir(root) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                if not entry.name.startswith('.'):
+                    yield from _iter_supported(entry.path)
+            elif os.path.splitext(entry.name)[1].lower() in SUPPORTED_EXTENSIONS and entry.is_file():
+                yield entry
+
+# Maximum concurrent document cache lookups/updates against MongoDB
+CACHE_CHECK_CONCURRENCY = 32
+
+# Per-file parse results are logged at DEBUG; INFO gets a progress line every this many files
+PROGRESS_LOG_EVERY_FILES = 25
+
+# Vector store insertion: chunks per batch and number of batches embedded/upserted at once
+VECTOR_BATCH_SIZE = int(os.environ.get("VECTOR_BATCH_SIZE", "64"))
+VECTOR_BATCH_CONCURRENCY = int(os.environ.get("VECTOR_BATCH_CONCURRENCY", "2"))
 
 # Define Models
 class Settings(BaseModel):
@@ -94,55 +188,174 @@ class ChatSession(BaseModel):
 class DocumentStatus(BaseModel):
     total_documents: int
     indexed_documents: int
-    last_updated: Optional[str] = None
+    last_updated: Optional[datetime] = None
+
+# Directory listings are reused for a few seconds (and until the files directory changes)
+DOCUMENT_LISTING_TTL_SECONDS = 5.0
+_document_listing_cache = {"key": None, "expires": 0.0, "files": []}
+
+# Last /documents/status response
+DOCUMENT_STATUS_TTL_SECONDS = 2.0
+_document_status_cache = {"value": None, "expires": 0.0}
+
+def invalidate_document_caches():
+    """Force the next status/list request to rescan (after file events or a reindex)"""
+    _document_listing_cache["expires"] = 0.0
+    _document_status_cache["expires"] = 0.0
 
 # File watcher for monitoring /app/files
-class DocumentFileHandler(FileSystemEventHandler):
-    def __init__(self):
-        import threading
-        self._lock = threading.Lock()
-        self._pending_reindex = False
+# Hidden files, editor swap/backup files and temp files never trigger a reindex
+WATCH_IGNORE_PATTERNS = [".*", "*~", "*.tmp", "*.swp"]
+
+class DocumentFileHandler(PatternMatchingEventHandler):
+    """Collects changed file paths; bursts of events are coalesced into one reindex
+    
+    Watchdog callbacks run on the observer thread; they only hand the path over to the
+    event loop, so all state below is touched from the loop thread alone. Events for
+    directories, unsupported extensions, hidden files and editor temp files are
+    filtered out by watchdog before they reach the callbacks.
+    """
+    
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        super().__init__(
+            patterns=[f"*{ext}" for ext in sorted(SUPPORTED_EXTENSIONS)],
+            ignore_patterns=WATCH_IGNORE_PATTERNS,
+            ignore_directories=True,
+            case_sensitive=False
+        )
+        self._loop = loop
+        self.changed = asyncio.Event()
+        self._changed_paths = set()
+        self._first_event_time = 0.0
+        self._last_event_time = 0.0
     
     @property
     def pending_reindex(self):
-        with self._lock:
-            return self._pending_reindex
+        return bool(self._changed_paths)
+    
+    def _record_change(self, path: str):
+        now = time.monotonic()
+        if not self._changed_paths:
+            self._first_event_time = now
+        self._changed_paths.add(path)
+        self._last_event_time = now
+        self.changed.set()
+        invalidate_document_caches()
+    
+    def seconds_until_ready(self, debounce: float, max_latency: float) -> float:
+        """Time left until events have been quiet for `debounce` seconds
+        (or the oldest change is `max_latency` seconds old)"""
+        ready_at = min(self._last_event_time + debounce, self._first_event_time + max_latency)
+        return max(0.0, ready_at - time.monotonic())
     
-    @pending_reindex.setter
-    def pending_reindex(self, value):
-        with self._lock:
-            self._pending_reindex = value
+    def pop_changed_paths(self) -> set:
+        """Take the collected paths and reset the change signal"""
+        paths = self._changed_paths
+        self._changed_paths = set()
+        self.changed.clear()
+        return paths
         
     def on_created(self, event):
-        if not event.is_directory:
-            logger.info(f"File created: {event.src_path}")
-            self.pending_reindex = True
+        logger.info(f"File created: {event.src_path}")
+        self._loop.call_soon_threadsafe(self._record_change, event.src_path)
     
     def on_modified(self, event):
-        if not event.is_directory:
-            logger.info(f"File modified: {event.src_path}")
-            self.pending_reindex = True
+        logger.info(f"File modified: {event.src_path}")
+        self._loop.call_soon_threadsafe(self._record_change, event.src_path)
+    
+    def on_deleted(self, event):
+        logger.info(f"File deleted: {event.src_path}")
+        self._loop.call_soon_threadsafe(self._record_change, event.src_path)
+    
+    def on_moved(self, event):
+        # Editors often save by renaming a temp file over the original, and a renamed
+        # document leaves its old path to be dropped from the index
+        logger.info(f"File moved: {event.src_path} -> {event.dest_path}")
+        for path in (os.fsdecode(event.src_path), os.fsdecode(event.dest_path)):
+            if os.path.splitext(path)[1].lower() in SUPPORTED_EXTENSIONS:
+                self._loop.call_soon_threadsafe(self._record_change, path)
+
+# Watcher reindex debounce: wait for this many quiet seconds, but never delay a change longer than the cap
+REINDEX_DEBOUNCE_SECONDS = 0.5
+REINDEX_MAX_LATENCY_SECONDS = 10.0
+
+# Set once the startup indexing pass has finished (reported by /readyz)
+initial_index_ready = asyncio.Event()
+
+async def run_initial_index():
+    """Startup indexing pass, run in the background so the API serves requests meanwhile"""
+    try:
+        await process_documents(clear_existing=False, use_cache=True)
+    finally:
+        initial_index_ready.set()
 
 async def check_reindex_pending():
-    """Background task to check if reindexing is needed"""
+    """Background task to reindex files changed since the last pass"""
     global file_handler
+    # Changes seen during the startup pass are picked up right after it
+    await initial_index_ready.wait()
     while True:
-        await asyncio.sleep(5)  # Check every 5 seconds
-        if file_handler and file_handler.pending_reindex:
-            logger.info("Pending reindex detected, processing documents...")
-            file_handler.pending_reindex = False
-            await process_documents()
+        await file_handler.changed.wait()
+        
+        # Debounce: keep waiting while new events extend the quiet period
+        while (delay := file_handler.seconds_until_ready(REINDEX_DEBOUNCE_SECONDS, REINDEX_MAX_LATENCY_SECONDS)) > 0:
+            await asyncio.sleep(delay)
+        
+        changed_paths = file_handler.pop_changed_paths()
+        logger.info(f"Pending reindex detected for {len(changed_paths)} changed path(s), processing documents...")
+        await process_documents(specific_files=[Path(path) for path in changed_paths])
+
+# Last fields written to the status document by this process (None until the first write)
+_last_document_status: Optional[Dict] = None
+
+async def save_document_status(fields: Dict):
+    """Upsert the indexing status, skipping the write when none of the fields changed"""
+    global _last_document_status
+    invalidate_document_caches()
+    if _last_document_status is not None and all(
+        _last_document_status.get(key) == value for key, value in fields.items()
+    ):
+        return
+    
+    await db.document_status.update_one(
+        {"id": "status"},
+        {"$set": fields, "$currentDate": {"last_updated": True}},
+        upsert=True
+    )
+    _last_document_status = {**(_last_document_status or {}), **fields}
+
+async def purge_removed_documents(file_paths: List[str]) -> int:
+    """Drop the indexed chunks and cache entries of files that no longer exist
+    
+    Returns the number of chunks removed from the vector store.
+    """
+    entries = await asyncio.gather(*(document_cache.get_cached_document(path) for path in file_paths))
+    removed = [(path, entry) for path, entry in zip(file_paths, entries) if entry]
+    if not removed:
+        return 0
+    
+    chunk_ids = [chunk_id for _, entry in removed for chunk_id in entry.get('chunk_ids', [])]
+    logger.info(f"Removing {len(chunk_ids)} chunks of {len(removed)} deleted file(s)")
+    if chunk_ids:
+        await asyncio.to_thread(vector_service.delete_documents, chunk_ids)
+        await asyncio.to_thread(vector_service.rebuild_sparse_index)
+    await asyncio.gather(*(document_cache.remove_cache_entry(path) for path, _ in removed))
+    return len(chunk_ids)
 
 # Background task to process documents with OPTIMIZED parallel processing
-async def process_documents(clear_existing: bool = False, use_cache: bool = True):
+async def process_documents(
+    clear_existing: bool = False,
+    use_cache: bool = True,
+    specific_files: Optional[List[Path]] = None
+):
     """Process all documents in files directory with parallel processing and caching
     
     Args:
         clear_existing: If True, clears existing vector store and cache before reindexing
         use_cache: If True, uses cache to skip unchanged documents
+        specific_files: If given, only these files are considered (e.g. paths reported by the file watcher)
     """
     try:
-        import time
         start_time = time.time()
         
         # Use dynamic path from config_paths
@@ -152,23 +365,37 @@ async def process_documents(clear_existing: bool = False, use_cache: bool = True
             files_dir.mkdir(parents=True, exist_ok=True)
             return
         
-        supported_extensions = ['.pdf', '.docx', '.doc', '.xlsx', '.xls', '.odt', '.txt', '.md', '.json', '.csv']
-        files = [f for f in files_dir.rglob('*') if f.suffix.lower() in supported_extensions]
+        all_files = [Path(entry.path) for entry in _iter_supported(str(files_dir))]
+        if specific_files is not None:
+            # Only reprocess the requested files that still exist and are supported
+            requested = {path.resolve() for path in specific_files}
+            files = [f for f in all_files if f.resolve() in requested]
+        else:
+            files = all_files
+        
+        # Deleted (or renamed) files: drop what was indexed for them
+        if use_cache and not clear_existing:
+            if specific_files is not None:
+                missing = sorted(str(path) for path in specific_files if not path.exists())
+            else:
+                present = {str(f) for f in all_files}
+                missing = sorted(set(await document_cache.get_all_cached_files()) - present)
+            if missing:
+                try:
+                    if await purge_removed_documents(missing):
+                        await save_document_status({"total_documents": len(all_files)})
+                except Exception as e:
+                    logger.error(f"Error removing deleted documents: {e}", exc_info=True)
         
         logger.info(f"Found {len(files)} documents to process (clear_existing={clear_existing}, use_cache={use_cache})")
         
+        if specific_files is not None and all_files and not files:
+            logger.info("No supported documents among the changed paths")
+            return
+        
         if not files:
             logger.warning("No documents found in files directory")
-            await db.document_status.update_one(
-                {"id": "status"},
-                {
-                    "$set": {
-                        "last_updated": datetime.now(timezone.utc).isoformat(),
-                        "total_documents": 0
-                    }
-                },
-                upsert=True
-            )
+            await save_document_status({"total_documents": 0})
             return
         
         # Clear vector store and cache if requested (for full reindex)
@@ -181,11 +408,19 @@ async def process_documents(clear_existing: bool = False, use_cache: bool = True
         # Filter files to process based on cache
         files_to_process = []
         skipped_files = []
+        stale_ids = []
         
         if use_cache:
             logger.info("Checking cache for unchanged documents...")
-            for file_path in files:
-                is_changed = await document_cache.is_document_changed(file_path)
+            # Issue all cache lookups concurrently (bounded so the Mongo pool isn't flooded)
+            cache_semaphore = asyncio.Semaphore(CACHE_CHECK_CONCURRENCY)
+            
+            async def check_changed(file_path: Path) -> bool:
+                async with cache_semaphore:
+                    return await document_cache.is_document_changed(file_path)
+            
+            changed_flags = await asyncio.gather(*(check_changed(file_path) for file_path in files))
+            for file_path, is_changed in zip(files, changed_flags):
                 if is_changed:
                     files_to_process.append(file_path)
                 else:
@@ -193,151 +428,214 @@ async def process_documents(clear_existing: bool = False, use_cache: bool = True
                     logger.debug(f"Skipping unchanged file: {file_path.name}")
             
             logger.info(f"Cache check complete: {len(files_to_process)} files to process, {len(skipped_files)} files skipped")
+            
+            # Changed files: drop the chunks indexed for their previous version before re-adding them
+            async def cached_chunk_ids(file_path: Path) -> List[str]:
+                async with cache_semaphore:
+                    entry = await document_cache.get_cached_document(str(file_path))
+                return entry.get('chunk_ids', []) if entry else []
+            
+            stale_ids = [
+                chunk_id
+                for chunk_ids in await asyncio.gather(*(cached_chunk_ids(file_path) for file_path in files_to_process))
+                for chunk_id in chunk_ids
+            ]
+            if stale_ids:
+                logger.info(f"Removing {len(stale_ids)} outdated chunks of changed files")
+                try:
+                    await asyncio.to_thread(vector_service.delete_documents, stale_ids)
+                except Exception as e:
+                    logger.error(f"Error removing outdated chunks: {e}", exc_info=True)
         else:
             files_to_process = files
         
         if not files_to_process:
             logger.info("No files need processing (all cached)")
-            # Still update status
-            await db.document_status.update_one(
-                {"id": "status"},
-                {
-                    "$set": {
-                        "last_updated": datetime.now(timezone.utc).isoformat(),
-                        "total_documents": len(files)
-                    }
-                },
-                upsert=True
-            )
+            # Still update status (skipped when the document count is unchanged)
+            await save_document_status({"total_documents": len(all_files)})
             return
         
-        # PARALLEL PROCESSING: Process multiple documents simultaneously
+        # PIPELINE: parse documents on the shared worker pool and stream their chunks into
+        # the vector store as each file finishes, so parsing overlaps embedding/upserts
         logger.info(f"Starting parallel processing of {len(files_to_process)} documents...")
         
-        # Use asyncio to run document processing in parallel
-        loop = asyncio.get_event_loop()
-        
-        # Process documents in parallel using ProcessPoolExecutor
-        with ProcessPoolExecutor(max_workers=min(4, len(files_to_process))) as executor:
-            # Submit all document processing tasks
-            futures = [
-                loop.run_in_executor(
-                    executor,
-                    doc_processor.process_document,
-                    str(file_path)
-                )
-                for file_path in files_to_process
-            ]
-            
-            # Wait for all to complete
-            processing_results = await asyncio.gather(*futures, return_exceptions=True)
+        loop = asyncio.get_running_loop()
+        io_executor = get_io_thread_pool()
+        
+        # Parsed files waiting to be inserted: (file_path, chunks, shared file metadata), None marks the end
+        chunk_queue = asyncio.Queue(maxsize=4 * VECTOR_BATCH_SIZE)
+        batch_semaphore = asyncio.Semaphore(VECTOR_BATCH_CONCURRENCY)
+        cache_semaphore = asyncio.Semaphore(CACHE_CHECK_CONCURRENCY)
+        parse_semaphore = asyncio.Semaphore(MAX_INFLIGHT_PARSES)
         
-        # Collect all chunks and metadata for batch insertion
-        all_chunks = []
-        all_metadata = []
         successful_files = 0
         failed_files = []
-        file_chunk_map = {}  # Track chunks per file for cache
+        total_chunks = 0
+        inserted_batches = 0
         
-        for file_path, result in zip(files_to_process, processing_results):
+        async def parse_file(file_path: Path):
+            # The slot is released by produce() once the result has been handled
+            await parse_semaphore.acquire()
+            error = None
+            for _ in range(2):
+                executor = io_executor if file_path.suffix.lower() in IO_BOUND_EXTENSIONS else get_process_pool()
+                try:
+                    return file_path, await loop.run_in_executor(
+                        executor,
+                        process_document_in_worker,
+                        str(file_path)
+                    )
+                except BrokenProcessPool as e:
+                    # A worker died: replace the pool and retry once
+                    logger.warning(f"Document worker pool broke while parsing {file_path.name}, restarting it")
+                    discard_process_pool(executor)
+                    error = e
+                except Exception as e:
+                    return file_path, e
+            return file_path, error
+        
+        # One timestamp for every chunk indexed in this pass (Chroma metadata only takes strings, not dates)
+        processed_at = datetime.now(timezone.utc).isoformat()
+        
+        async def produce():
+            nonlocal successful_files, total_chunks
+            handled_files = 0
             try:
-                if isinstance(result, Exception):
-                    logger.error(f"✗ Error processing {file_path.name}: {result}")
-                    failed_files.append(file_path.name)
-                    continue
-                
-                text_chunks = result
-                
-                if text_chunks:
-                    # Prepare metadata for all chunks
-                    file_metadata = [
-                        {
-                            "source": file_path.name,
-                            "chunk_index": i,
-                            "total_chunks": len(text_chunks),
-                            "file_type": file_path.suffix.lower(),
-                            "file_size": file_path.stat().st_size,
-                            "processed_at": datetime.now(timezone.utc).isoformat()
-                        }
-                        for i in range(len(text_chunks))
-                    ]
-                    
-                    # Add to batch
-                    chunk_start_idx = len(all_chunks)
-                    all_chunks.extend(text_chunks)
-                    all_metadata.extend(file_metadata)
-                    
-                    file_chunk_map[str(file_path)] = {
-                        'chunk_count': len(text_chunks),
-                        'start_idx': chunk_start_idx
-                    }
-                    
-                    successful_files += 1
-                    logger.info(f"✓ Processed {file_path.name}: {len(text_chunks)} chunks")
-                else:
-                    logger.warning(f"✗ No text extracted from {file_path.name}")
-                    failed_files.append(file_path.name)
-            except Exception as e:
-                logger.error(f"✗ Error handling result for {file_path.name}: {e}", exc_info=True)
-                failed_files.append(file_path.name)
+                for next_result in asyncio.as_completed([parse_file(file_path) for file_path in files_to_process]):
+                    file_path, result = await next_result
+                    try:
+                        if isinstance(result, Exception):
+                            logger.error(f"✗ Error processing {file_path.name}: {result}")
+                            failed_files.append(file_path.name)
+                            continue
+                        
+                        text_chunks = result
+                        
+                        if text_chunks:
+                            # Metadata shared by every chunk of the file; per-chunk dicts are
+                            # only expanded when the batch is inserted
+                            file_metadata = {
+                                "source": sys.intern(file_path.name),
+                                "total_chunks": len(text_chunks),
+                                "file_type": sys.intern(file_path.suffix.lower()),
+                                "file_size": file_path.stat().st_size,
+                                "processed_at": processed_at
+                            }
+                            
+                            await chunk_queue.put((file_path, text_chunks, file_metadata))
+                            total_chunks += len(text_chunks)
+                            successful_files += 1
+                            logger.debug(f"✓ Processed {file_path.name}: {len(text_chunks)} chunks")
+                        else:
+                            logger.warning(f"✗ No text extracted from {file_path.name}")
+                            failed_files.append(file_path.name)
+                    except Exception as e:
+                        logger.error(f"✗ Error handling result for {file_path.name}: {e}", exc_info=True)
+                        failed_files.append(file_path.name)
+                    finally:
+                        parse_semaphore.release()
+                        handled_files += 1
+                        if handled_files % PROGRESS_LOG_EVERY_FILES == 0 or handled_files == len(files_to_process):
+                            logger.info(f"Parsed {handled_files}/{len(files_to_process)} documents ({total_chunks} chunks so far)")
+            finally:
+                await chunk_queue.put(None)
         
-        # BATCH INSERT: Add all chunks to vector store in one optimized batch operation
-        total_chunks = len(all_chunks)
-        if total_chunks > 0:
-            logger.info(f"Batch inserting {total_chunks} chunks into vector store...")
-            batch_start = time.time()
-            
+        async def update_file_cache(file_path: Path, chunk_ids: List[str]):
+            async with cache_semaphore:
+                await document_cache.update_cache(file_path, len(chunk_ids), chunk_ids)
+        
+        async def insert_files(parsed_files: List) -> List:
+            """Insert the files' chunks, retrying a failed batch in halves so one bad file
+            doesn't drop the rest; returns the (files, chunk_ids) groups that were stored"""
+            nonlocal inserted_batches
+            texts = [chunk for _, chunks, _ in parsed_files for chunk in chunks]
+            metadata = [
+                {**file_metadata, "chunk_index": i}
+                for _, chunks, file_metadata in parsed_files
+                for i in range(len(chunks))
+            ]
             try:
-                # Use optimized batch insertion
-                chunk_ids = vector_service.add_documents_batch(
-                    texts=all_chunks,
-                    metadata=all_metadata,
-                    batch_size=100  # Process in batches of 100
+                chunk_ids = await loop.run_in_executor(
+                    None,
+                    vector_service.add_documents_batch,
+                    texts,
+                    metadata,
+                    VECTOR_BATCH_SIZE
                 )
-                
-                batch_time = time.time() - batch_start
-                logger.info(f"Batch insertion completed in {batch_time:.2f}s ({total_chunks/batch_time:.1f} chunks/sec)")
-                
-                # Update cache for all successfully processed files
-                if use_cache and chunk_ids:
-                    for file_path in files_to_process:
-                        file_key = str(file_path)
-                        if file_key in file_chunk_map:
-                            info = file_chunk_map[file_key]
-                            start_idx = info['start_idx']
-                            chunk_count = info['chunk_count']
-                            file_chunk_ids = chunk_ids[start_idx:start_idx+chunk_count]
-                            
-                            await document_cache.update_cache(
-                                file_path,
-                                chunk_count,
-                                file_chunk_ids
-                            )
             except Exception as e:
-                logger.error(f"Error in batch insertion: {e}", exc_info=True)
-                # Don't fail the entire process, just log the error
+                if len(parsed_files) == 1:
+                    # Don't fail the entire process, just log the error
+                    logger.error(f"Error in batch insertion for {parsed_files[0][0].name}: {e}", exc_info=True)
+                    return []
+                half = len(parsed_files) // 2
+                logger.warning(f"Batch insertion of {len(texts)} chunks failed ({e}), retrying in halves")
+                return await insert_files(parsed_files[:half]) + await insert_files(parsed_files[half:])
+            
+            inserted_batches += 1
+            return [(parsed_files, chunk_ids)]
+        
+        async def flush(parsed_files: List):
+            # Caller already holds a batch_semaphore slot
+            try:
+                inserted = await insert_files(parsed_files)
+            finally:
+                batch_semaphore.release()
+            
+            # Update cache for the files in this batch as soon as their chunk IDs are known
+            if use_cache:
+                updates = []
+                for files, chunk_ids in inserted:
+                    start_idx = 0
+                    for file_path, chunks, _ in files:
+                        updates.append(update_file_cache(file_path, chunk_ids[start_idx:start_idx+len(chunks)]))
+                        start_idx += len(chunks)
+                await asyncio.gather(*updates)
+        
+        async def consume():
+            # Whole files are grouped until VECTOR_BATCH_SIZE chunks accumulate, then flushed
+            flushes = []
+            pending = []
+            pending_chunks = 0
+            while True:
+                item = await chunk_queue.get()
+                if item is not None:
+                    pending.append(item)
+                    pending_chunks += len(item[1])
+                if pending and (item is None or pending_chunks >= VECTOR_BATCH_SIZE):
+                    # Waiting for a free slot here applies back-pressure to the parsers
+                    await batch_semaphore.acquire()
+                    flushes.append(asyncio.create_task(flush(pending)))
+                    pending = []
+                    pending_chunks = 0
+                if item is None:
+                    break
+            await asyncio.gather(*flushes)
+        
+        logger.info(f"Streaming chunks into vector store (batch size {VECTOR_BATCH_SIZE}, concurrency {VECTOR_BATCH_CONCURRENCY})...")
+        pipeline_start = time.time()
+        await asyncio.gather(produce(), consume())
+        
+        if total_chunks > 0 or stale_ids:
+            await loop.run_in_executor(None, vector_service.rebuild_sparse_index)
+        if total_chunks > 0:
+            pipeline_time = time.time() - pipeline_start
+            logger.info(f"Parsed and inserted {total_chunks} chunks in {inserted_batches} batches in {pipeline_time:.2f}s "
+                        f"({total_chunks/pipeline_time:.1f} chunks/sec)")
         
         # Save updated timestamp to database
-        await db.document_status.update_one(
-            {"id": "status"},
-            {
-                "$set": {
-                    "last_updated": datetime.now(timezone.utc).isoformat(),
-                    "total_documents": len(files),
-                    "successful_files": successful_files + len(skipped_files),  # Include cached files
-                    "failed_files": failed_files,
-                    "total_chunks": total_chunks,
-                    "processing_time_seconds": time.time() - start_time,
-                    "files_processed": len(files_to_process),
-                    "files_cached": len(skipped_files)
-                }
-            },
-            upsert=True
-        )
+        await save_document_status({
+            "total_documents": len(all_files),
+            "successful_files": successful_files + len(skipped_files),  # Include cached files
+            "failed_files": failed_files,
+            "total_chunks": total_chunks,
+            "processing_time_seconds": time.time() - start_time,
+            "files_processed": len(files_to_process),
+            "files_cached": len(skipped_files)
+        })
         
         elapsed_time = time.time() - start_time
         logger.info(f"✅ Document processing completed in {elapsed_time:.2f}s:")
-        logger.info(f"   - Total files: {len(files)}")
+        logger.info(f"   - Total files: {len(all_files)}")
         logger.info(f"   - Processed: {successful_files} files, {total_chunks} chunks")
         logger.info(f"   - Cached: {len(skipped_files)} files")
         logger.info(f"   - Failed: {len(failed_files)} files")
@@ -374,7 +672,6 @@ async def health_check():
             documents_indexed = 0
         
         # Calculate uptime (if startup time is tracked)
-        import time
         uptime_seconds = int(time.time() - startup_time) if 'startup_time' in globals() else None
         
         return {
@@ -389,6 +686,18 @@ async def health_check():
         logger.error(f"Health check error: {e}")
         raise HTTPException(status_code=500, detail=f"Health check failed: {str(e)}")
 
+@api_router.get("/healthz")
+async def liveness_check():
+    """Liveness probe: the process is up and serving requests"""
+    return {"status": "ok"}
+
+@api_router.get("/readyz")
+async def readiness_check():
+    """Readiness probe: 503 until the startup indexing pass has completed"""
+    if not initial_index_ready.is_set():
+        raise HTTPException(status_code=503, detail="Initial document indexing in progress")
+    return {"status": "ready"}
+
 @api_router.get("/settings", response_model=Settings)
 async def get_settings():
     """Get current settings"""
@@ -397,21 +706,33 @@ async def get_settings():
         # Return default settings
         return Settings(id="main", cerebras_api_key=None)
     
-    if isinstance(settings.get('updated_at'), str):
-        settings['updated_at'] = datetime.fromisoformat(settings['updated_at'])
-    
+    # updated_at is a BSON date (legacy ISO strings are parsed by the model)
     return Settings(**settings)
 
+# Settings document cached in-process for the chat path (refreshed by update_settings)
+SETTINGS_CACHE_TTL_SECONDS = 30.0
+_settings_cache: Optional[Dict] = None
+_settings_cache_ts = 0.0
+
+async def get_settings_cached() -> Optional[Dict]:
+    """Return the main settings document (API key only), hitting MongoDB at most once per TTL"""
+    global _settings_cache, _settings_cache_ts
+    if _settings_cache is None or time.monotonic() - _settings_cache_ts >= SETTINGS_CACHE_TTL_SECONDS:
+        _settings_cache = await db.settings.find_one({"id": "main"}, {"_id": 0, "cerebras_api_key": 1})
+        _settings_cache_ts = time.monotonic()
+    return _settings_cache
+
 @api_router.post("/settings", response_model=Settings)
 async def update_settings(settings_update: SettingsUpdate):
     """Update settings (API key)"""
+    global _settings_cache, _settings_cache_ts
+    
     settings_obj = Settings(
         id="main",
         cerebras_api_key=settings_update.cerebras_api_key
     )
     
     doc = settings_obj.model_dump()
-    doc['updated_at'] = doc['updated_at'].isoformat()
     
     await db.settings.update_one(
         {"id": "main"},
@@ -419,82 +740,120 @@ async def update_settings(settings_update: SettingsUpdate):
         upsert=True
     )
     
-    # Update RAG service with new API key
-    rag_service.update_api_key(settings_update.cerebras_api_key)
+    _settings_cache = doc
+    _settings_cache_ts = time.monotonic()
+    
+    # Update RAG service only when the key actually changed
+    if rag_service.api_key != settings_update.cerebras_api_key:
+        rag_service.update_api_key(settings_update.cerebras_api_key)
     
     return settings_obj
 
+class ChatTurn(BaseModel):
+    """Validated chat request with everything needed to answer and persist it"""
+    api_key: str
+    session_id: str
+    chat_history: List[Dict]
+    user_doc: Dict
+
+async def start_chat_turn(request: ChatRequest) -> ChatTurn:
+    """Validate the request, resolve the API key and session, and load recent history"""
+    # Validate input
+    if not request.message or not request.message.strip():
+        raise HTTPException(status_code=400, detail="Message cannot be empty")
+    
+    if len(request.message) > 10000:
+        raise HTTPException(status_code=400, detail="Message too long (max 10,000 characters)")
+    
+    # Get API key from settings
+    settings = await get_settings_cached()
+    if not settings or not settings.get('cerebras_api_key'):
+        raise HTTPException(
+            status_code=400, 
+            detail="Cerebras API key not configured. Please add your API key in the Settings page. "
+                   "Get one from: https://cloud.cerebras.ai"
+        )
+    
+    # Generate session_id if not provided
+    session_id = request.session_id or str(uuid.uuid4())
+    
+    # Get chat history for this session (last 10 messages for context, oldest first).
+    # Newest-first on the (session_id, timestamp) index, fetching only role and content.
+    recent_messages = await db.chat_messages.find(
+        {"session_id": session_id},
+        {"_id": 0, "role": 1, "content": 1}
+    ).sort("timestamp", -1).limit(10).to_list()
+    
+    # User message (timestamped now, saved together with the answer)
+    user_message = ChatMessage(
+        session_id=session_id,
+        role="user",
+        content=request.message.strip()
+    )
+    
+    return ChatTurn(
+        api_key=settings['cerebras_api_key'],
+        session_id=session_id,
+        chat_history=recent_messages[::-1],
+        user_doc=user_message.model_dump()
+    )
+
+def rag_error_to_http(rag_error: Exception) -> HTTPException:
+    """Map a RAG service failure to a user-friendly HTTP error"""
+    error_msg = str(rag_error)
+    
+    # Check for specific error types and provide helpful messages
+    if "quota" in error_msg.lower() or "exceeded" in error_msg.lower() or "rate" in error_msg.lower():
+        return HTTPException(
+            status_code=429,
+            detail="API rate limit exceeded. "
+                   "Please check your API key's billing details at https://cloud.cerebras.ai "
+                   "or try again later."
+        )
+    elif "unauthorized" in error_msg.lower() or "invalid" in error_msg.lower() or "authentication" in error_msg.lower():
+        return HTTPException(
+            status_code=401,
+            detail="Invalid API key. Please check your Cerebras API key in Settings. "
+                   "Get a valid key from: https://cloud.cerebras.ai"
+        )
+    else:
+        return HTTPException(
+            status_code=500,
+            detail=f"Failed to generate response: {error_msg}"
+        )
+
+async def save_chat_messages(session_id: str, user_doc: Dict, assistant_doc: Optional[Dict] = None):
+    """Persist a chat turn in one round-trip (just the user message when no answer was produced)"""
+    try:
+        if assistant_doc is None:
+            await db.chat_messages.insert_one(user_doc)
+        else:
+            await db.chat_messages.insert_many([user_doc, assistant_doc], ordered=False)
+    except Exception as e:
+        logger.error(f"Failed to save chat messages for session {session_id}: {e}")
+
 @api_router.post("/chat", response_model=ChatResponse)
 async def chat(request: ChatRequest):
     """Chat with RAG agent with comprehensive error handling"""
     try:
-        # Validate input
-        if not request.message or not request.message.strip():
-            raise HTTPException(status_code=400, detail="Message cannot be empty")
-        
-        if len(request.message) > 10000:
-            raise HTTPException(status_code=400, detail="Message too long (max 10,000 characters)")
-        
-        # Get API key from settings
-        settings = await db.settings.find_one({"id": "main"})
-        if not settings or not settings.get('cerebras_api_key'):
-            raise HTTPException(
-                status_code=400, 
-                detail="Cerebras API key not configured. Please add your API key in the Settings page. "
-                       "Get one from: https://cloud.cerebras.ai"
-            )
-        
-        # Generate session_id if not provided
-        session_id = request.session_id or str(uuid.uuid4())
-        
-        # Get chat history for this session (last 10 messages for context)
-        chat_history = await db.chat_messages.find(
-            {"session_id": session_id},
-            {"_id": 0}
-        ).sort("timestamp", 1).to_list(10)
-        
-        # Save user message
-        user_message = ChatMessage(
-            session_id=session_id,
-            role="user",
-            content=request.message.strip()
-        )
-        user_doc = user_message.model_dump()
-        user_doc['timestamp'] = user_doc['timestamp'].isoformat()
-        await db.chat_messages.insert_one(user_doc)
+        turn = await start_chat_turn(request)
+        session_id = turn.session_id
         
         # Get response from RAG service
         try:
             response_text, sources, spelling_suggestion = await rag_service.get_response(
                 query=request.message.strip(),
                 session_id=session_id,
-                api_key=settings['cerebras_api_key'],
-                chat_history=chat_history
+                api_key=turn.api_key,
+                chat_history=turn.chat_history
             )
         except Exception as rag_error:
             # Log the error and provide user-friendly message
-            error_msg = str(rag_error)
-            logger.error(f"RAG service error for session {session_id}: {error_msg}")
+            logger.error(f"RAG service error for session {session_id}: {rag_error}")
             
-            # Check for specific error types and provide helpful messages
-            if "quota" in error_msg.lower() or "exceeded" in error_msg.lower() or "rate" in error_msg.lower():
-                raise HTTPException(
-                    status_code=429,
-                    detail="API rate limit exceeded. "
-                           "Please check your API key's billing details at https://cloud.cerebras.ai "
-                           "or try again later."
-                )
-            elif "unauthorized" in error_msg.lower() or "invalid" in error_msg.lower() or "authentication" in error_msg.lower():
-                raise HTTPException(
-                    status_code=401,
-                    detail="Invalid API key. Please check your Cerebras API key in Settings. "
-                           "Get a valid key from: https://cloud.cerebras.ai"
-                )
-            else:
-                raise HTTPException(
-                    status_code=500,
-                    detail=f"Failed to generate response: {error_msg}"
-                )
+            # Keep the user's message in the history even though no answer was produced
+            await save_chat_messages(session_id, turn.user_doc)
+            raise rag_error_to_http(rag_error)
         
         # Save assistant message
         assistant_message = ChatMessage(
@@ -504,8 +863,9 @@ async def chat(request: ChatRequest):
             sources=sources
         )
         assistant_doc = assistant_message.model_dump()
-        assistant_doc['timestamp'] = assistant_doc['timestamp'].isoformat()
-        await db.chat_messages.insert_one(assistant_doc)
+        
+        # Save both messages in one round-trip (a failed write is logged; the answer is still returned)
+        await save_chat_messages(session_id, turn.user_doc, assistant_doc)
         
         logger.info(f"Successfully processed chat for session {session_id}, found {len(sources)} sources")
         
@@ -521,18 +881,98 @@ async def chat(request: ChatRequest):
         logger.error(f"Unexpected chat error: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
+# Background tasks (startup work, streamed-answer persistence), kept referenced until they finish
+_background_tasks = set()
+
+def _on_background_task_done(task: asyncio.Task):
+    _background_tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logger.error(f"Background task {task.get_name()} failed", exc_info=task.exception())
+
+def spawn_background_task(coro, name: str) -> asyncio.Task:
+    """Run a coroutine in the background, keeping a reference and logging its failure"""
+    task = asyncio.create_task(coro, name=name)
+    _background_tasks.add(task)
+    task.add_done_callback(_on_background_task_done)
+    return task
+
+def sse_event(payload: Dict) -> str:
+    """Format one Server-Sent Events message"""
+    return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+@api_router.post("/chat/stream")
+async def chat_stream(request: ChatRequest):
+    """Streaming variant of /chat (Server-Sent Events)
+    
+    Events: one {"session_id", "sources", "spelling_suggestion"} event, then {"delta": text}
+    events as the answer is generated, then {"done": true} (or {"error": message}).
+    """
+    try:
+        turn = await start_chat_turn(request)
+        session_id = turn.session_id
+        
+        try:
+            chunks, sources, spelling_suggestion = await rag_service.get_response_stream(
+                query=request.message.strip(),
+                session_id=session_id,
+                api_key=turn.api_key,
+                chat_history=turn.chat_history
+            )
+        except Exception as rag_error:
+            logger.error(f"RAG service error for session {session_id}: {rag_error}")
+            await save_chat_messages(session_id, turn.user_doc)
+            raise rag_error_to_http(rag_error)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Unexpected chat error: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+    
+    async def events():
+        parts = []
+        assistant_doc = None
+        try:
+            yield sse_event({
+                "session_id": session_id,
+                "sources": sources,
+                "spelling_suggestion": spelling_suggestion
+            })
+            async for chunk in chunks:
+                parts.append(chunk)
+                yield sse_event({"delta": chunk})
+            
+            assistant_doc = ChatMessage(
+                session_id=session_id,
+                role="assistant",
+                content=''.join(parts),
+                sources=sources
+            ).model_dump()
+            yield sse_event({"done": True})
+            logger.info(f"Successfully streamed chat for session {session_id}, found {len(sources)} sources")
+        except Exception as rag_error:
+            logger.error(f"RAG streaming error for session {session_id}: {rag_error}")
+            yield sse_event({"error": rag_error_to_http(rag_error).detail})
+        finally:
+            # Persist after the answer is sent, without holding up the response
+            task = asyncio.create_task(save_chat_messages(session_id, turn.user_doc, assistant_doc))
+            _background_tasks.add(task)
+            task.add_done_callback(_background_tasks.discard)
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @api_router.get("/chat/history/{session_id}", response_model=List[ChatMessage])
 async def get_chat_history(session_id: str):
     """Get chat history for a session"""
     messages = await db.chat_messages.find(
         {"session_id": session_id},
         {"_id": 0}
-    ).sort("timestamp", 1).to_list(100)
-    
-    for msg in messages:
-        if isinstance(msg.get('timestamp'), str):
-            msg['timestamp'] = datetime.fromisoformat(msg['timestamp'])
+    ).sort("timestamp", 1).limit(100).to_list()
     
+    # Timestamps are BSON dates; legacy ISO strings are parsed by the response model
     return messages
 
 @api_router.get("/chat/sessions", response_model=List[ChatSession])
@@ -562,7 +1002,7 @@ async def get_chat_sessions():
             }
         ]
         
-        sessions_data = await db.chat_messages.aggregate(pipeline).to_list(50)
+        sessions_data = await (await db.chat_messages.aggregate(pipeline)).to_list(50)
         
         sessions = []
         for session_data in sessions_data:
@@ -606,64 +1046,78 @@ async def delete_chat_session(session_id: str):
 
 @api_router.get("/documents/status", response_model=DocumentStatus)
 async def get_document_status():
-    """Get document indexing status"""
-    status = await db.document_status.find_one({"id": "status"}, {"_id": 0})
+    """Get document indexing status (cached briefly; the UI polls this endpoint)"""
+    cache = _document_status_cache
+    if cache["value"] is not None and time.monotonic() < cache["expires"]:
+        return cache["value"]
     
-    files_dir = Path(config_paths.FILES_DIR_STR)
-    supported_extensions = ['.pdf', '.docx', '.doc', '.xlsx', '.xls', '.odt', '.txt', '.md', '.json', '.csv']
-    files = [f for f in files_dir.rglob('*') if f.suffix.lower() in supported_extensions] if files_dir.exists() else []
+    status, files, indexed_documents = await asyncio.gather(
+        db.document_status.find_one({"id": "status"}, {"_id": 0}),
+        asyncio.to_thread(get_document_listing),
+        asyncio.to_thread(vector_service.get_collection_count)
+    )
     
-    return DocumentStatus(
+    result = DocumentStatus(
         total_documents=len(files),
-        indexed_documents=vector_service.get_collection_count(),
+        indexed_documents=indexed_documents,
         last_updated=status.get('last_updated') if status else None
     )
+    cache.update(value=result, expires=time.monotonic() + DOCUMENT_STATUS_TTL_SECONDS)
+    return result
+
+def _scan_documents(directory: str) -> List[Dict]:
+    """List supported documents, stat-ing each file a single time"""
+    documents = []
+    for entry in _iter_supported(directory):
+        stat = entry.stat()
+        documents.append({
+            "name": entry.name,
+            "size": stat.st_size,
+            "modified": stat.st_mtime,
+            "extension": os.path.splitext(entry.name)[1].lower()
+        })
+    return documents
+
+def get_document_listing() -> List[Dict]:
+    """Supported documents in the files directory (cached for DOCUMENT_LISTING_TTL_SECONDS)"""
+    files_dir = Path(config_paths.FILES_DIR_STR)
+    if not files_dir.exists():
+        return []
+    
+    key = files_dir.stat().st_mtime_ns
+    now = time.monotonic()
+    cache = _document_listing_cache
+    if cache["key"] == key and now < cache["expires"]:
+        return cache["files"]
+    
+    files = _scan_documents(str(files_dir))
+    cache.update(key=key, expires=now + DOCUMENT_LISTING_TTL_SECONDS, files=files)
+    return files
 
 @api_router.get("/documents/list")
 async def list_documents():
     """Get list of all documents categorized by type"""
     try:
-        files_dir = Path(config_paths.FILES_DIR_STR)
+        listing = await asyncio.to_thread(get_document_listing)
         
-        if not files_dir.exists():
-            return {"documents_by_type": {}, "total_count": 0}
-        
-        # Define file categories
-        categories = {
-            "PDF": ['.pdf'],
-            "Word": ['.docx', '.doc'],
-            "Excel": ['.xlsx', '.xls'],
-            "Text": ['.txt', '.md'],
-            "Data": ['.json', '.csv'],
-            "OpenDocument": ['.odt']
-        }
+        # Group files by category (one pass, categories keep their display order)
+        grouped = {category: [] for category in DOCUMENT_CATEGORIES}
+        for file_info in listing:
+            grouped[EXTENSION_CATEGORY[file_info["extension"]]].append({
+                **file_info,
+                "size_formatted": format_file_size(file_info["size"])
+            })
         
-        # Collect files by category
         documents_by_type = {}
-        total_count = 0
-        
-        for category, extensions in categories.items():
-            files = []
-            for ext in extensions:
-                found_files = list(files_dir.rglob(f'*{ext}'))
-                for file_path in found_files:
-                    files.append({
-                        "name": file_path.name,
-                        "size": file_path.stat().st_size,
-                        "size_formatted": format_file_size(file_path.stat().st_size),
-                        "modified": file_path.stat().st_mtime,
-                        "extension": file_path.suffix.lower()
-                    })
-            
+        for category, files in grouped.items():
             if files:
                 # Sort by name
                 files.sort(key=lambda x: x['name'])
                 documents_by_type[category] = files
-                total_count += len(files)
         
         return {
             "documents_by_type": documents_by_type,
-            "total_count": total_count
+            "total_count": len(listing)
         }
     
     except Exception as e:
@@ -719,10 +1173,16 @@ app.add_middleware(
 )
 
 # Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+# Log records are queued and written to stderr by a background listener thread,
+# so request handlers and ingestion never block on log I/O
+log_queue = queue.Queue(-1)
+log_stream_handler = logging.StreamHandler()
+log_stream_handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+log_queue_handler = logging.handlers.QueueHandler(log_queue)
+log_queue_handler.setFormatter(logging.Formatter('%(message)s'))  # final formatting happens in the listener
+logging.basicConfig(level=logging.INFO, handlers=[log_queue_handler])
+log_listener = logging.handlers.QueueListener(log_queue, log_stream_handler, respect_handler_level=True)
+log_listener.start()
 logger = logging.getLogger(__name__)
 
 # File watcher setup
@@ -730,39 +1190,79 @@ observer = None
 file_handler = None
 startup_time = None
 
+async def ensure_indexes():
+    """Create the MongoDB indexes used by the chat and status queries (no-op when they exist)"""
+    indexes = [
+        (db.chat_messages, [("session_id", 1), ("timestamp", 1)], {}),
+        (db.settings, [("id", 1)], {"unique": True}),
+        (db.document_status, [("id", 1)], {"unique": True}),
+        (db.document_cache, [("file_path", 1)], {"unique": True}),
+    ]
+    for collection, keys, options in indexes:
+        try:
+            await collection.create_index(keys, background=True, **options)
+        except Exception as e:
+            # e.g. a unique index over pre-existing duplicates; queries still work without it
+            logger.warning(f"Could not create index {keys} on {collection.name}: {e}")
+
 @app.on_event("startup")
 async def startup_event():
     """Initialize services and start file watcher"""
     global observer, file_handler, startup_time
     
-    import time
     startup_time = time.time()
     
     logger.info("Starting NeuralStark API with optimized processing")
     
-    # Process existing documents with caching (incremental)
-    await process_documents(clear_existing=False, use_cache=True)
+    # Connect before serving traffic so the first request doesn't pay for server selection
+    try:
+        await db.command('ping')
+    except Exception as e:
+        logger.error(f"MongoDB is not reachable at startup: {e}")
+    
+    await ensure_indexes()
+    
+    # Start the document processing workers once; every reindex reuses them
+    get_process_pool()
+    
+    # Warm up models in the background so the first chat request doesn't pay for it
+    spawn_background_task(asyncio.to_thread(rag_service.warmup), "model-warmup")
+    
+    # Process existing documents with caching (incremental) without holding up startup
+    spawn_background_task(run_initial_index(), "initial-index")
     
     # Start file watcher
     files_dir = Path(config_paths.FILES_DIR_STR)
+    files_dir.mkdir(parents=True, exist_ok=True)  # the indexing pass may not have created it yet
     if files_dir.exists():
-        file_handler = DocumentFileHandler()
+        file_handler = DocumentFileHandler(asyncio.get_running_loop())
         observer = Observer()
         observer.schedule(file_handler, str(files_dir), recursive=True)
         observer.start()
         logger.info(f"File watcher started for {files_dir}")
         
         # Start background task to check for pending reindexing
-        asyncio.create_task(check_reindex_pending())
+        spawn_background_task(check_reindex_pending(), "reindex-watcher")
 
 @app.on_event("shutdown")
 async def shutdown_event():
     """Cleanup on shutdown"""
-    global observer
+    global observer, process_pool, io_thread_pool
     
     if observer:
         observer.stop()
         observer.join()
     
-    client.close()
-    logger.info("NeuralStark API shutdown complete")
\ No newline at end of file
+    if process_pool:
+        process_pool.shutdown(wait=True)
+        process_pool = None
+    
+    if io_thread_pool:
+        io_thread_pool.shutdown(wait=True)
+        io_thread_pool = None
+    
+    await client.close()
+    logger.info("NeuralStark API shutdown complete")
+    
+    # Flush queued log records
+    log_listener.stop()
\ No newline at end of file
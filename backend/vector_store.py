@@ -1,6 +1,8 @@
+import asyncio
 import logging
 from typing import List, Dict, Tuple, Optional
 from pathlib import Path
+import numpy as np
 import chromadb
 from chromadb.config import Settings
 from sentence_transformers import SentenceTransformer
@@ -10,6 +12,14 @@ from cache_manager import EmbeddingCache, QueryCache
 
 logger = logging.getLogger(__name__)
 
+# HNSW settings for the documents collection (also used when it is recreated)
+COLLECTION_METADATA = {
+    "description": "RAG document embeddings",
+    "hnsw:space": "cosine",  # Cosine similarity for HNSW
+    "hnsw:construction_ef": 200,  # Higher = better quality
+    "hnsw:search_ef": 100  # Higher = better recall
+}
+
 
 class VectorStoreService:
     """OPTIMIZED service with embedding cache and HNSW indexing"""
@@ -36,6 +46,10 @@ class VectorStoreService:
         self.query_cache = QueryCache(max_size=500, ttl_seconds=3600)
         logger.info("Initialized embedding and query caches")
         
+        # Bumped whenever the indexed documents change; part of the query cache key so
+        # results computed before an (re)index are never served afterwards
+        self.collection_version = 0
+        
         # Initialize hybrid retriever
         self.hybrid_retriever = HybridRetriever()
         
@@ -48,12 +62,7 @@ class VectorStoreService:
             # Create with HNSW metadata for optimized search
             self.collection = self.client.create_collection(
                 name=collection_name,
-                metadata={
-                    "description": "RAG document embeddings",
-                    "hnsw:space": "cosine",  # Cosine similarity for HNSW
-                    "hnsw:construction_ef": 200,  # Higher = better quality
-                    "hnsw:search_ef": 100  # Higher = better recall
-                }
+                metadata=COLLECTION_METADATA
             )
             logger.info(f"Created new collection with HNSW: {collection_name}")
     
@@ -103,6 +112,7 @@ class VectorStoreService:
             
             # Also index for BM25 sparse retrieval
             self.hybrid_retriever.index_documents(texts, metadata)
+            self.collection_version += 1
             
             logger.info(f"Added {len(texts)} documents to vector store and BM25 index (IDs: {ids[0]}...{ids[-1] if len(ids) > 1 else ''})")
         
@@ -110,7 +120,80 @@ class VectorStoreService:
             logger.error(f"Error adding documents to vector store: {e}")
             raise
     
-    def search(self, query: str, n_results: int = 5, use_hybrid: bool = True) -> Tuple[List[str], List[Dict]]:
+    def add_documents_batch(self, texts: List[str], metadata: List[Dict], batch_size: int = 64) -> List[str]:
+        """Embed and add documents to the dense collection in batches
+        
+        Safe to call concurrently from worker threads. The BM25 index is not touched;
+        call rebuild_sparse_index() once all batches of a pass are in. All or nothing:
+        if a batch fails, the batches already written by this call are deleted again.
+        
+        Returns:
+            List of document IDs that were added (same order as texts)
+        """
+        if not texts:
+            return []
+        
+        import time
+        import uuid
+        # Per-call token keeps IDs unique when several batches start in the same millisecond
+        prefix = f"doc_{int(time.time() * 1000)}_{uuid.uuid4().hex[:8]}"
+        all_ids = [f"{prefix}_{i}_{abs(hash(text)) % 10**8}" for i, text in enumerate(texts)]
+        
+        added = 0
+        try:
+            for i in range(0, len(texts), batch_size):
+                batch_texts = texts[i:i+batch_size]
+                embeddings = self.embedding_model.encode(
+                    batch_texts,
+                    show_progress_bar=False,
+                    batch_size=32,
+                    normalize_embeddings=True,
+                    convert_to_numpy=True
+                )
+                self.collection.add(
+                    embeddings=embeddings.tolist(),
+                    documents=batch_texts,
+                    metadatas=metadata[i:i+batch_size],
+                    ids=all_ids[i:i+batch_size]
+                )
+                added = i + len(batch_texts)
+        except Exception:
+            # Callers retry with fresh IDs, so chunks left behind would be duplicated or orphaned
+            if added:
+                try:
+                    self.collection.delete(ids=all_ids[:added])
+                except Exception as e:
+                    logger.error(f"Could not roll back {added} partially added documents: {e}")
+                self.collection_version += 1
+            raise
+        
+        self.collection_version += 1
+        logger.debug(f"Added {len(texts)} documents to vector store")
+        return all_ids
+    
+    def delete_documents(self, ids: List[str]):
+        """Remove documents from the dense collection by ID
+        
+        As with add_documents_batch, call rebuild_sparse_index() afterwards.
+        """
+        if not ids:
+            return
+        self.collection.delete(ids=ids)
+        self.collection_version += 1
+        logger.info(f"Deleted {len(ids)} documents from vector store")
+    
+    def rebuild_sparse_index(self):
+        """Rebuild the BM25 index from everything currently in the collection"""
+        self._reindex_bm25()
+        self.collection_version += 1
+    
+    def search(
+        self,
+        query: str,
+        n_results: int = 5,
+        use_hybrid: bool = True,
+        score_cutoff: Optional[float] = None
+    ) -> Tuple[List[str], List[Dict]]:
         """
         OPTIMIZED search with caching and HNSW
         
@@ -118,16 +201,20 @@ class VectorStoreService:
             query: Search query
             n_results: Number of results to return
             use_hybrid: Whether to use hybrid (dense + sparse) retrieval
+            score_cutoff: Minimum cosine similarity for dense hits; weaker dense hits are
+                          dropped before metadata is built (BM25 hits are not affected)
         
         Returns:
-            Tuple of (documents, metadata)
+            Tuple of (documents, metadata); the metadata dicts are fresh copies the caller may annotate
         """
         try:
             # Check query cache first (massive speedup for repeated queries)
-            cached_result = self.query_cache.get(query, n_results, use_hybrid)
+            version = self.collection_version
+            cached_result = self.query_cache.get(query, n_results, use_hybrid, score_cutoff, version)
             if cached_result is not None:
                 logger.info(f"Query cache HIT - returning cached results")
-                return cached_result
+                documents, metadatas = cached_result
+                return documents, [meta.copy() for meta in metadatas]
             
             # Check if collection has documents
             count = self.collection.count()
@@ -143,7 +230,7 @@ class VectorStoreService:
                 logger.info(f"Using hybrid retrieval (dense + BM25) for query: '{query[:50]}...'")
                 
                 # Step 1: Dense retrieval (semantic search with cache)
-                dense_docs, dense_metadata = self._search_dense(query, retrieval_count)
+                dense_docs, dense_metadata = self._search_dense(query, retrieval_count, score_cutoff)
                 
                 # Step 2: Sparse retrieval (BM25 keyword search)
                 sparse_docs, sparse_metadata, _ = self.hybrid_retriever.search_sparse(query, retrieval_count)
@@ -164,23 +251,29 @@ class VectorStoreService:
             else:
                 # DENSE ONLY: Semantic search with cache
                 logger.info(f"Using dense-only retrieval for query: '{query[:50]}...'")
-                documents, metadatas = self._search_dense(query, retrieval_count)
+                documents, metadatas = self._search_dense(query, retrieval_count, score_cutoff)
             
-            # Cache the result for future queries
-            self.query_cache.put(query, n_results, use_hybrid, (documents, metadatas))
+            # Cache the result for future queries (callers get copies: rerank scores must not leak into the cache)
+            self.query_cache.put(query, n_results, use_hybrid, (documents, metadatas), score_cutoff, version)
             
-            return documents, metadatas
+            return documents, [meta.copy() for meta in metadatas]
         
         except Exception as e:
             logger.error(f"Error searching vector store: {e}")
             return [], []
     
-    def _search_dense(self, query: str, n_results: int) -> Tuple[List[str], List[Dict]]:
-        """OPTIMIZED dense search with embedding cache"""
-        # Ensure n_results doesn't exceed available documents
-        count = self.collection.count()
-        n_results = min(n_results, count)
-        
+    async def search_async(
+        self,
+        query: str,
+        n_results: int = 5,
+        use_hybrid: bool = True,
+        score_cutoff: Optional[float] = None
+    ) -> Tuple[List[str], List[Dict]]:
+        """Run search() in a worker thread so several searches can overlap"""
+        return await asyncio.to_thread(self.search, query, n_results, use_hybrid, score_cutoff)
+    
+    def embed_query(self, query: str) -> np.ndarray:
+        """Get the normalized embedding for a query (uses the embedding cache)"""
         # Try to get embedding from cache
         query_embedding = self.embedding_cache.get(query, self.model_name)
         
@@ -199,6 +292,21 @@ class VectorStoreService:
         else:
             logger.debug("Using cached embedding")
         
+        return query_embedding
+    
+    def _search_dense(
+        self,
+        query: str,
+        n_results: int,
+        score_cutoff: Optional[float] = None
+    ) -> Tuple[List[str], List[Dict]]:
+        """OPTIMIZED dense search with embedding cache"""
+        # Ensure n_results doesn't exceed available documents
+        count = self.collection.count()
+        n_results = min(n_results, count)
+        
+        query_embedding = self.embed_query(query)
+        
         # Search in collection
         results = self.collection.query(
             query_embeddings=[query_embedding.tolist()],
@@ -210,11 +318,20 @@ class VectorStoreService:
         metadatas = results['metadatas'][0] if results['metadatas'] else []
         distances = results['distances'][0] if results['distances'] else []
         
+        # Apply relevance cutoff on raw distances, in the collection's distance space
+        if score_cutoff is not None and score_cutoff > 0 and distances:
+            max_distance = self._max_distance(score_cutoff)
+            kept = [i for i, distance in enumerate(distances) if distance <= max_distance]
+            if len(kept) < len(distances):
+                logger.debug(f"Score cutoff {score_cutoff} dropped {len(distances) - len(kept)} dense results")
+                documents = [documents[i] for i in kept]
+                metadatas = [metadatas[i] for i in kept]
+                distances = [distances[i] for i in kept]
+        
         # Enhanced relevance scoring
-        # ChromaDB returns L2 distance - convert to similarity score
         for i, metadata in enumerate(metadatas):
             if i < len(distances):
-                # Convert L2 distance to similarity score (0-1 range)
+                # Convert distance to similarity score (0-1 range)
                 distance = distances[i]
                 # Using exponential decay for better differentiation
                 relevance_score = max(0.0, min(1.0, 1.0 / (1.0 + distance)))
@@ -242,6 +359,17 @@ class VectorStoreService:
         
         return documents, metadatas
     
+    def _max_distance(self, min_similarity: float) -> float:
+        """Largest distance whose cosine similarity is still >= min_similarity
+        
+        Embeddings are normalized, so cosine and ip distances are 1 - similarity and
+        (squared) l2 distance is 2 - 2 * similarity.
+        """
+        space = (self.collection.metadata or {}).get("hnsw:space", "l2")
+        if space == "l2":
+            return 2.0 - 2.0 * min_similarity
+        return 1.0 - min_similarity
+    
     def clear_collection(self):
         """Clear all documents from the collection"""
         try:
@@ -249,10 +377,11 @@ class VectorStoreService:
             self.client.delete_collection(name=self.collection.name)
             self.collection = self.client.create_collection(
                 name=self.collection.name,
-                metadata={"description": "RAG document embeddings"}
+                metadata=COLLECTION_METADATA
             )
             # Clear BM25 index
             self.hybrid_retriever = HybridRetriever()
+            self.collection_version += 1
             logger.info("Cleared vector store collection and BM25 index")
         except Exception as e:
             logger.error(f"Error clearing collection: {e}")
@@ -262,6 +391,8 @@ class VectorStoreService:
         try:
             count = self.collection.count()
             if count == 0:
+                # Drop the previous index too, or BM25 keeps returning purged chunks
+                self.hybrid_retriever = HybridRetriever()
                 logger.info("No existing documents to re-index for BM25")
                 return
             
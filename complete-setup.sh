@@ -85,7 +85,7 @@ print_info "[1/6] Installing core FastAPI packages..."
 pip install fastapi uvicorn[standard] python-multipart python-dotenv --no-cache-dir 2>&1 | grep -E "(Successfully|ERROR)" || true
 
 print_info "[2/6] Installing database packages..."
-pip install motor pymongo dnspython --no-cache-dir 2>&1 | grep -E "(Successfully|ERROR)" || true
+pip install "pymongo>=4.13.0" dnspython --no-cache-dir 2>&1 | grep -E "(Successfully|ERROR)" || true
 
 print_info "[3/6] Installing AI/ML packages (this takes longest)..."
 pip install google-generativeai chromadb sentence-transformers --no-cache-dir 2>&1 | grep -E "(Successfully|ERROR)" || true
@@ -122,7 +122,7 @@ FAILED=0
 # Test critical packages
 test_import "FastAPI" "fastapi" || FAILED=$((FAILED+1))
 test_import "Uvicorn" "uvicorn" || FAILED=$((FAILED+1))
-test_import "Motor" "motor" || FAILED=$((FAILED+1))
+test_import "PyMongo" "pymongo" || FAILED=$((FAILED+1))
 test_import "Google Generative AI" "google.generativeai" || FAILED=$((FAILED+1))
 test_import "ChromaDB" "chromadb" || FAILED=$((FAILED+1))
 test_import "Sentence Transformers" "sentence_transformers" || FAILED=$((FAILED+1))
@@ -483,7 +483,7 @@ install_backend_deps() {
         # Install critical packages
         print_message "Installing critical packages..."
         pip install --upgrade pip setuptools wheel
-        pip install fastapi uvicorn[standard] motor python-dotenv python-multipart || {
+        pip install fastapi uvicorn[standard] "pymongo>=4.13.0" python-dotenv python-multipart || {
             print_error "Failed to install critical packages"
             return 1
         }
@@ -504,7 +504,7 @@ install_backend_deps() {
         print_message "Checking existing dependencies..."
         
         # Test critical imports
-        if python -c "import fastapi, uvicorn, motor" 2>/dev/null; then
+        if python -c "import fastapi, uvicorn, pymongo" 2>/dev/null; then
             print_message "✓ Critical packages already installed"
             
             # Check if all packages from requirements.txt are installed
@@ -524,7 +524,7 @@ install_backend_deps() {
                 print_warning "Some packages could not be installed, checking critical ones..."
                 
                 # Verify critical packages work
-                if python -c "import fastapi, uvicorn, motor, chromadb" 2>/dev/null; then
+                if python -c "import fastapi, uvicorn, pymongo, chromadb" 2>/dev/null; then
                     print_message "✅ Critical packages are functional"
                     print_warning "Some optional packages may be missing (non-critical)"
                 else
@@ -534,8 +534,8 @@ install_backend_deps() {
                     print_message "1/5 Installing FastAPI..."
                     pip install fastapi uvicorn[standard] || print_error "FastAPI failed"
                     
-                    print_message "2/5 Installing Motor (MongoDB)..."
-                    pip install motor python-dotenv || print_error "Motor failed"
+                    print_message "2/5 Installing PyMongo (MongoDB)..."
+                    pip install "pymongo>=4.13.0" python-dotenv || print_error "PyMongo failed"
                     
                     print_message "3/5 Installing Google Generative AI..."
                     pip install google-generativeai || print_error "Google Generative AI failed"
@@ -550,7 +550,7 @@ install_backend_deps() {
                     pip install langchain langchain-community langchain-core langchain-text-splitters || print_warning "LangChain failed"
                     
                     # Test again
-                    if python -c "import fastapi, uvicorn, motor" 2>/dev/null; then
+                    if python -c "import fastapi, uvicorn, pymongo" 2>/dev/null; then
                         print_message "✅ Critical packages installed successfully"
                     else
                         print_error "Failed to install critical packages - backend may not work"
@@ -570,14 +570,14 @@ install_backend_deps() {
             done
             
             # Verify installation
-            if python -c "import fastapi, uvicorn, motor" 2>/dev/null; then
+            if python -c "import fastapi, uvicorn, pymongo" 2>/dev/null; then
                 print_message "✅ Backend dependencies installed successfully"
             else
                 print_error "Installation completed but critical packages missing"
                 print_message "Attempting to fix by installing critical packages..."
-                pip install fastapi uvicorn[standard] motor python-dotenv
+                pip install fastapi uvicorn[standard] "pymongo>=4.13.0" python-dotenv
                 
-                if python -c "import fastapi, uvicorn, motor" 2>/dev/null; then
+                if python -c "import fastapi, uvicorn, pymongo" 2>/dev/null; then
                     print_message "✅ Critical packages now working"
                 else
                     print_error "Critical packages still missing - manual intervention needed"
@@ -0,0 +1,100 @@
+import time
+
+import numpy as np
+
+from cache_manager import AnswerCache, ResponseCache, ScoreCache, SemanticCache, content_hash
+
+
+def test_content_hash_is_stable_64_bit():
+    assert content_hash("chunk text") == content_hash("chunk text")
+    assert content_hash("chunk text") != content_hash("chunk text.")
+    assert 0 <= content_hash("chunk text") < 2 ** 64
+
+
+def test_response_cache_evicts_least_recently_used():
+    cache = ResponseCache(max_size=2, ttl_seconds=60)
+    cache.put("model", "system", "q1", "a1")
+    cache.put("model", "system", "q2", "a2")
+    assert cache.get("model", "system", "q1") == "a1"  # q2 is now the least recently used
+    
+    cache.put("model", "system", "q3", "a3")
+    
+    assert cache.get("model", "system", "q2") is None
+    assert cache.get("model", "system", "q1") == "a1"
+    assert cache.get("model", "system", "q3") == "a3"
+
+
+def test_response_cache_key_includes_model_and_prompt():
+    cache = ResponseCache()
+    cache.put("model", "system", "query", "answer")
+    
+    assert cache.get("other-model", "system", "query") is None
+    assert cache.get("model", "other system", "query") is None
+
+
+def test_answer_cache_expires_entries_and_counts_misses():
+    cache = AnswerCache(ttl_seconds=0)
+    cache.put("query", "answer", tag=(False, 1))
+    time.sleep(0.01)
+    
+    assert cache.get("query", tag=(False, 1)) is None
+    assert cache.get_stats()["misses"] == 1
+    assert cache.get_stats()["size"] == 0
+
+
+def test_answer_cache_requires_matching_tag():
+    cache = AnswerCache()
+    cache.put("query", "answer", tag=(False, 1))
+    
+    assert cache.get("query", tag=(False, 2)) is None
+    assert cache.get("query", tag=(False, 1)) == "answer"
+
+
+def test_semantic_cache_matches_similar_embeddings_with_same_tag():
+    cache = SemanticCache(max_size=4, similarity_threshold=0.9)
+    cache.put(np.array([1.0, 0.0, 0.0]), "answer", tag=(False, 1))
+    
+    assert cache.get(np.array([0.99, 0.05, 0.0]), tag=(False, 1)) == "answer"
+    assert cache.get(np.array([0.0, 1.0, 0.0]), tag=(False, 1)) is None
+    # A reindex bumps the version in the tag, which invalidates the entry
+    assert cache.get(np.array([1.0, 0.0, 0.0]), tag=(False, 2)) is None
+
+
+def test_semantic_cache_overwrites_oldest_slot_when_full():
+    cache = SemanticCache(max_size=2, similarity_threshold=0.99)
+    cache.put(np.array([1.0, 0.0, 0.0]), "a")
+    cache.put(np.array([0.0, 1.0, 0.0]), "b")
+    cache.put(np.array([0.0, 0.0, 1.0]), "c")
+    
+    assert cache.size == 2
+    assert cache.get(np.array([1.0, 0.0, 0.0])) is None
+    assert cache.get(np.array([0.0, 1.0, 0.0])) == "b"
+    assert cache.get(np.array([0.0, 0.0, 1.0])) == "c"
+
+
+def test_score_matrix_scores_only_misses_in_one_call():
+    cache = ScoreCache()
+    cache.put_many("q1", [10, 11], [0.1, 0.2])
+    calls = []
+    
+    def score_fn(rows, cols):
+        calls.append((list(rows), list(cols)))
+        return [float(row * 10 + col) for row, col in zip(rows, cols)]
+    
+    matrix = cache.score_matrix(["q1", "q2"], [10, 11, 12], score_fn)
+    
+    assert calls == [([0, 1, 1, 1], [2, 0, 1, 2])]
+    np.testing.assert_allclose(matrix, [[0.1, 0.2, 2.0], [10.0, 11.0, 12.0]], rtol=1e-6)
+    
+    # Everything is cached now: no further scoring
+    cache.score_matrix(["q1", "q2"], [10, 11, 12], score_fn)
+    assert len(calls) == 1
+
+
+def test_score_cache_keys_on_exact_query_text():
+    cache = ScoreCache()
+    cache.put_many("Paris", [1], [0.9])
+    
+    _, misses = cache.get_many("paris", [1])
+    
+    assert misses == [0]
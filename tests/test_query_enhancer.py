@@ -0,0 +1,36 @@
+from query_enhancer import QueryEnhancer, TokenInfo
+
+
+def test_build_variations_expands_abbreviations():
+    tokens = [
+        TokenInfo(original="le", corrected="le"),
+        TokenInfo(original="PDG", corrected="PDG", abbrev="président-directeur général"),
+    ]
+    
+    variations = QueryEnhancer()._build_variations(tokens)
+    
+    assert variations == ["le PDG", "le président-directeur général"]
+
+
+def test_build_variations_combines_synonyms_and_abbreviations():
+    tokens = [
+        TokenInfo(original="big", corrected="big", synonyms=["large"]),
+        TokenInfo(original="ceo", corrected="ceo", abbrev="chief executive officer"),
+    ]
+    
+    variations = QueryEnhancer()._build_variations(tokens)
+    
+    assert variations == [
+        "big ceo",
+        "large ceo",
+        "big chief executive officer",
+        "large chief executive officer",
+    ]
+
+
+def test_build_variations_does_not_expand_a_swapped_token():
+    tokens = [TokenInfo(original="hr", corrected="hr", synonyms=["personnel"], abbrev="human resources")]
+    
+    variations = QueryEnhancer()._build_variations(tokens)
+    
+    assert variations == ["hr", "personnel", "human resources"]
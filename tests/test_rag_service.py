@@ -0,0 +1,167 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+
+import httpx
+import numpy as np
+import pytest
+from cerebras.cloud.sdk import APIStatusError
+
+from rag_service import (
+    MAX_BACKOFF,
+    RAGService,
+    RetrievedDoc,
+    _is_retryable_llm_error,
+    _retry_after_seconds,
+    merge_variation_results,
+    retry_with_backoff,
+    rrf_fuse,
+)
+
+
+def test_merge_keeps_same_named_files_from_different_folders_apart():
+    # Both folders hold a rapport.pdf: same source name and chunk_index, different text
+    results = [
+        (["Chiffre d'affaires 2023", "Effectif 2023"],
+         [{'source': 'rapport.pdf', 'chunk_index': 0}, {'source': 'rapport.pdf', 'chunk_index': 1}]),
+        (["Chiffre d'affaires 2024"],
+         [{'source': 'rapport.pdf', 'chunk_index': 0}]),
+    ]
+    
+    docs, _ = merge_variation_results(results)
+    
+    assert sorted(docs) == ["Chiffre d'affaires 2023", "Chiffre d'affaires 2024", "Effectif 2023"]
+
+
+def test_merge_fuses_a_chunk_found_by_several_variations():
+    results = [
+        (["a", "b"], [{'relevance_score': 0.4}, {'relevance_score': 0.9}]),
+        (["b", "c"], [{'relevance_score': 0.7}, {'relevance_score': 0.5}]),
+    ]
+    
+    docs, metadata = merge_variation_results(results)
+    
+    assert docs == ["b", "a", "c"]
+    # The most relevant copy is kept, annotated with its fused score
+    assert metadata[0]['relevance_score'] == 0.9
+    np.testing.assert_allclose(metadata[0]['fusion_score'], 1 / 62 + 1 / 61)
+
+
+def test_merge_of_empty_results():
+    assert merge_variation_results([([], []), ([], [])]) == ([], [])
+
+
+def test_rrf_fuse_sums_reciprocal_ranks():
+    keys, scores = rrf_fuse([np.array([1, 2, 3], dtype=np.uint64), np.array([3, 1], dtype=np.uint64)], k=60)
+    
+    assert keys.tolist() == [1, 3, 2]
+    np.testing.assert_allclose(scores, [1 / 61 + 1 / 62, 1 / 63 + 1 / 61, 1 / 62])
+
+
+def test_rrf_fuse_breaks_ties_by_first_seen_order():
+    keys, _ = rrf_fuse([np.array([7], dtype=np.uint64), np.array([5], dtype=np.uint64)])
+    
+    assert keys.tolist() == [7, 5]
+
+
+def test_rrf_fuse_handles_no_lists():
+    keys, scores = rrf_fuse([])
+    
+    assert keys.size == 0 and scores.size == 0
+
+
+def _budget_service(max_context_tokens: int) -> RAGService:
+    # Only the token budget state is needed; skip model loading in __init__
+    service = RAGService.__new__(RAGService)
+    service._enc = None  # chars / CHARS_PER_TOKEN estimate
+    service.max_context_tokens = max_context_tokens
+    return service
+
+
+def _doc(text: str) -> RetrievedDoc:
+    return RetrievedDoc(text=text, source="doc.pdf", chunk_index=0, relevance=0.5,
+                        reranker_score=0.5, retrieval_method="hybrid")
+
+
+def test_fit_context_budget_stops_at_the_token_budget():
+    service = _budget_service(max_context_tokens=400)
+    docs = [_doc("x" * 400) for _ in range(5)]  # ~100 tokens each plus header overhead
+    
+    kept = service._fit_context_budget(docs)
+    
+    assert 1 <= len(kept) < len(docs)
+    assert kept == docs[:len(kept)]
+
+
+def test_fit_context_budget_always_keeps_the_top_document():
+    service = _budget_service(max_context_tokens=10)
+    docs = [_doc("x" * 4000), _doc("short")]
+    
+    assert service._fit_context_budget(docs) == docs[:1]
+
+
+def _status_error(status_code: int, message: str = "error", headers=None) -> APIStatusError:
+    request = httpx.Request("POST", "https://api.cerebras.ai/v1/chat/completions")
+    response = httpx.Response(status_code, headers=headers or {}, request=request)
+    return APIStatusError(message, response=response, body=None)
+
+
+def test_retry_classification():
+    assert _is_retryable_llm_error(_status_error(429))  # no Retry-After hint: jittered backoff
+    assert _is_retryable_llm_error(_status_error(503))
+    assert not _is_retryable_llm_error(_status_error(400))
+    assert not _is_retryable_llm_error(_status_error(401))
+    assert not _is_retryable_llm_error(ValueError("boom"))
+
+
+def test_retry_after_parses_seconds_and_http_dates():
+    assert _retry_after_seconds(_status_error(429, headers={"retry-after": "2"})) == 2.0
+    
+    retry_at = format_datetime(datetime.now(timezone.utc) + timedelta(seconds=30), usegmt=True)
+    assert 25 <= _retry_after_seconds(_status_error(429, headers={"retry-after": retry_at})) <= 30
+    
+    # The day of the month in an HTTP-date must not be read as a delay in seconds
+    past = "Retry-After: Wed, 21 Oct 2015 07:28:00 GMT"
+    assert _retry_after_seconds(_status_error(429, message=past)) == 0.0
+    assert _retry_after_seconds(_status_error(429, message="retry after 3 seconds")) == 3.0
+
+
+def _flaky(errors, monkeypatch):
+    """Coroutine function raising `errors` in turn, then returning "ok"; sleeps are skipped"""
+    async def no_sleep(_):
+        pass
+    monkeypatch.setattr("rag_service.asyncio.sleep", no_sleep)
+    calls = []
+    
+    @retry_with_backoff(max_retries=3, retry_if=_is_retryable_llm_error)
+    async def call():
+        calls.append(1)
+        if len(calls) <= len(errors):
+            raise errors[len(calls) - 1]
+        return "ok"
+    
+    return call, calls
+
+
+def test_retry_with_backoff_retries_rate_limit_without_hint(monkeypatch):
+    call, calls = _flaky([_status_error(429), _status_error(429)], monkeypatch)
+    
+    assert asyncio.run(call()) == "ok"
+    assert len(calls) == 3
+
+
+def test_retry_with_backoff_fails_fast_on_long_retry_after(monkeypatch):
+    error = _status_error(429, headers={"retry-after": str(MAX_BACKOFF * 10)})
+    call, calls = _flaky([error], monkeypatch)
+    
+    with pytest.raises(APIStatusError):
+        asyncio.run(call())
+    assert len(calls) == 1
+
+
+def test_retry_with_backoff_does_not_retry_client_errors(monkeypatch):
+    call, calls = _flaky([_status_error(400)], monkeypatch)
+    
+    with pytest.raises(APIStatusError):
+        asyncio.run(call())
+    assert len(calls) == 1
@@ -0,0 +1,143 @@
+import asyncio
+import os
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+# server connects lazily, so placeholder settings are enough to import it
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "neuralstark_test")
+
+import config_paths  # noqa: E402
+import server  # noqa: E402
+
+
+class FakeVectorStore:
+    """Records inserted chunks; batches containing `fail_marker` are rejected"""
+    
+    def __init__(self):
+        self.texts = {}
+        self.batches = []
+        self.deleted = []
+        self.sparse_rebuilds = 0
+        self.fail_marker = None
+    
+    def add_documents_batch(self, texts, metadata, batch_size=64):
+        if self.fail_marker and any(self.fail_marker in text for text in texts):
+            raise RuntimeError("embedding failed")
+        ids = [f"chunk-{len(self.texts) + i}" for i in range(len(texts))]
+        self.texts.update(zip(ids, texts))
+        self.batches.append(len(texts))
+        return ids
+    
+    def delete_documents(self, ids):
+        self.deleted.extend(ids)
+    
+    def rebuild_sparse_index(self):
+        self.sparse_rebuilds += 1
+
+
+class FakeDocumentCache:
+    """In-memory stand-in for the MongoDB-backed DocumentCache"""
+    
+    def __init__(self):
+        self.entries = {}
+    
+    async def is_document_changed(self, file_path):
+        return True
+    
+    async def get_cached_document(self, file_path):
+        return self.entries.get(file_path)
+    
+    async def update_cache(self, file_path, chunks_count, chunk_ids):
+        self.entries[str(file_path)] = {"chunk_ids": chunk_ids}
+    
+    async def get_all_cached_files(self):
+        return list(self.entries)
+    
+    async def remove_cache_entry(self, file_path):
+        self.entries.pop(file_path, None)
+
+
+@pytest.fixture
+def pipeline(tmp_path, monkeypatch):
+    store = FakeVectorStore()
+    cache = FakeDocumentCache()
+    statuses = []
+    
+    async def record_status(fields):
+        statuses.append(fields)
+    
+    monkeypatch.setattr(config_paths, "FILES_DIR_STR", str(tmp_path))
+    monkeypatch.setattr(server, "vector_service", store)
+    monkeypatch.setattr(server, "document_cache", cache)
+    monkeypatch.setattr(server, "save_document_status", record_status)
+    # One chunk per line; .txt files are parsed on the I/O thread pool
+    monkeypatch.setattr(server, "process_document_in_worker", lambda path: Path(path).read_text().splitlines())
+    return SimpleNamespace(files_dir=tmp_path, store=store, cache=cache, statuses=statuses)
+
+
+def _write(files_dir: Path, name: str) -> Path:
+    path = files_dir / f"{name}.txt"
+    path.write_text(f"{name} 1\n{name} 2\n")
+    return path
+
+
+def _cached_texts(pipeline, path: Path):
+    return [pipeline.store.texts[chunk_id] for chunk_id in pipeline.cache.entries[str(path)]["chunk_ids"]]
+
+
+def test_process_documents_streams_every_file_into_the_store(pipeline, monkeypatch):
+    monkeypatch.setattr(server, "VECTOR_BATCH_SIZE", 2)
+    paths = [_write(pipeline.files_dir, name) for name in ("a", "b", "c")]
+    
+    asyncio.run(server.process_documents())
+    
+    # Each file fills a batch on its own, so it is flushed without waiting for the others
+    assert pipeline.store.batches == [2, 2, 2]
+    for path in paths:
+        assert _cached_texts(pipeline, path) == [f"{path.stem} 1", f"{path.stem} 2"]
+    assert pipeline.store.sparse_rebuilds == 1
+    assert pipeline.statuses[-1]["total_chunks"] == 6
+    assert pipeline.statuses[-1]["failed_files"] == []
+
+
+def test_failed_insert_batch_is_retried_in_halves(pipeline, monkeypatch):
+    monkeypatch.setattr(server, "VECTOR_BATCH_SIZE", 100)  # every file lands in one batch
+    pipeline.store.fail_marker = "bad"
+    good = [_write(pipeline.files_dir, name) for name in ("a", "b", "c")]
+    bad = _write(pipeline.files_dir, "bad")
+    
+    asyncio.run(server.process_documents())
+    
+    # Only the batch holding the bad file is dropped; the other files are stored and cached
+    assert sorted(pipeline.store.texts.values()) == sorted(f"{path.stem} {i}" for path in good for i in (1, 2))
+    for path in good:
+        assert _cached_texts(pipeline, path) == [f"{path.stem} 1", f"{path.stem} 2"]
+    assert str(bad) not in pipeline.cache.entries
+
+
+def test_deleted_file_reported_by_the_watcher_is_purged(pipeline):
+    kept = _write(pipeline.files_dir, "kept")
+    gone = pipeline.files_dir / "gone.txt"
+    pipeline.cache.entries[str(gone)] = {"chunk_ids": ["old-1", "old-2"]}
+    
+    asyncio.run(server.process_documents(specific_files=[gone]))
+    
+    assert pipeline.store.deleted == ["old-1", "old-2"]
+    assert pipeline.store.sparse_rebuilds == 1
+    assert str(gone) not in pipeline.cache.entries
+    assert pipeline.store.texts == {}  # the unchanged file was not part of this pass
+    assert kept.exists()
+
+
+def test_full_scan_purges_files_renamed_since_the_last_pass(pipeline):
+    renamed = _write(pipeline.files_dir, "after")
+    pipeline.cache.entries[str(pipeline.files_dir / "before.txt")] = {"chunk_ids": ["old-1"]}
+    
+    asyncio.run(server.process_documents())
+    
+    assert pipeline.store.deleted == ["old-1"]
+    assert list(pipeline.cache.entries) == [str(renamed)]
+    assert _cached_texts(pipeline, renamed) == ["after 1", "after 2"]
@@ -0,0 +1,116 @@
+import numpy as np
+import pytest
+
+from hybrid_retriever import HybridRetriever
+from vector_store import COLLECTION_METADATA, VectorStoreService
+
+
+class FakeCollection:
+    """In-memory stand-in for a Chroma collection (ids, documents, metadatas)"""
+    
+    def __init__(self, metadata=None, distances=None, fail_on_add=None):
+        self.name = "documents"
+        self.metadata = metadata
+        self.distances = distances or []
+        self.rows = {}
+        self.fail_on_add = fail_on_add  # 1-based add() call that raises
+        self.add_calls = 0
+    
+    def count(self):
+        return len(self.rows) or len(self.distances)
+    
+    def query(self, query_embeddings, n_results):
+        distances = self.distances[:n_results]
+        return {
+            'documents': [[f"doc {i}" for i in range(len(distances))]],
+            'metadatas': [[{'source': f"doc{i}.pdf"} for i in range(len(distances))]],
+            'distances': [distances],
+        }
+    
+    def add(self, embeddings, documents, metadatas, ids):
+        self.add_calls += 1
+        if self.add_calls == self.fail_on_add:
+            raise RuntimeError("disk full")
+        self.rows.update((id_, (document, meta)) for id_, document, meta in zip(ids, documents, metadatas))
+    
+    def delete(self, ids):
+        for id_ in ids:
+            self.rows.pop(id_, None)
+
+
+class FakeEmbeddingModel:
+    def encode(self, texts, **kwargs):
+        return np.zeros((len(texts), 3), dtype=np.float32)
+
+
+def _service(collection) -> VectorStoreService:
+    # Skip __init__ (it opens Chroma and loads the embedding model)
+    service = VectorStoreService.__new__(VectorStoreService)
+    service.collection = collection
+    service.collection_version = 0
+    service.embedding_model = FakeEmbeddingModel()
+    service.embed_query = lambda query: np.zeros(3, dtype=np.float32)
+    return service
+
+
+def test_collection_metadata_uses_cosine_space():
+    assert COLLECTION_METADATA["hnsw:space"] == "cosine"
+
+
+def test_score_cutoff_is_a_cosine_similarity_floor_in_cosine_space():
+    service = _service(FakeCollection(COLLECTION_METADATA, distances=[0.2, 0.6, 0.8, 1.5]))
+    
+    docs, metadatas = service._search_dense("query", 4, score_cutoff=0.3)
+    
+    # cosine distance = 1 - similarity: 0.8 and 1.5 are below a 0.3 similarity
+    assert [meta['distance'] for meta in metadatas] == [0.2, 0.6]
+
+
+def test_score_cutoff_is_scaled_for_l2_collections():
+    service = _service(FakeCollection({"description": "RAG document embeddings"}, distances=[0.5, 1.3, 1.5]))
+    
+    _, metadatas = service._search_dense("query", 3, score_cutoff=0.3)
+    
+    # squared l2 on unit vectors = 2 - 2 * similarity: the 0.3 floor is a distance of 1.4
+    assert [meta['distance'] for meta in metadatas] == [0.5, 1.3]
+
+
+def test_add_documents_batch_returns_ids_in_input_order():
+    collection = FakeCollection(COLLECTION_METADATA)
+    service = _service(collection)
+    texts = [f"chunk {i}" for i in range(5)]
+    
+    ids = service.add_documents_batch(texts, [{"chunk_index": i} for i in range(5)], batch_size=2)
+    
+    assert [collection.rows[id_][0] for id_ in ids] == texts
+    assert collection.add_calls == 3
+    assert service.collection_version == 1
+
+
+def test_add_documents_batch_rolls_back_written_batches_on_failure():
+    collection = FakeCollection(COLLECTION_METADATA, fail_on_add=3)
+    service = _service(collection)
+    texts = [f"chunk {i}" for i in range(5)]
+    
+    with pytest.raises(RuntimeError):
+        service.add_documents_batch(texts, [{"chunk_index": i} for i in range(5)], batch_size=2)
+    
+    # The first two batches were written, then deleted again: a retry starts from a clean slate
+    assert collection.rows == {}
+    assert service.collection_version == 1
+
+
+def test_rebuilding_an_emptied_collection_clears_the_sparse_index():
+    collection = FakeCollection(COLLECTION_METADATA)
+    service = _service(collection)
+    service.hybrid_retriever = HybridRetriever()
+    texts = ["budget annuel 2023", "rapport de stage", "contrat de travail"]
+    metadata = [{"source": f"doc{i}.pdf"} for i in range(3)]
+    ids = service.add_documents_batch(texts, metadata)
+    service.hybrid_retriever.index_documents(texts, metadata)
+    assert service.hybrid_retriever.search_sparse("budget")[0] == ["budget annuel 2023"]
+    
+    service.delete_documents(ids)
+    service.rebuild_sparse_index()
+    
+    assert service.hybrid_retriever.search_sparse("budget") == ([], [], [])